@@ -1,4 +1,23 @@
+import os
 from elise.task import celery_app
 
 # This file is used to launch the worker:
 # celery -A celery_worker.celery_app worker --loglevel=info
+#
+# By default a worker consumes every queue, chat first. CELERY_QUEUES (or -Q)
+# picks a subset, so each workload can get its own workers:
+# CELERY_QUEUES=chat,reports celery -A celery_worker.celery_app worker --pool=gevent --concurrency=64
+# CELERY_QUEUES=transcription,maintenance celery -A celery_worker.celery_app worker --concurrency=4
+#
+# Chat, report and transcription tasks mostly wait on OpenAI. An I/O worker
+# with the gevent pool keeps dozens of those requests in flight from a single
+# process (bounded by OPENAI_MAX_CONCURRENCY) over one pooled HTTP/2 client:
+# celery -A celery_worker.celery_app worker --loglevel=info --pool=gevent --concurrency=64
+# The pool has to be given with --pool (or -P): Celery only monkey-patches
+# sockets and threads for gevent when it is selected on the command line,
+# and a gevent pool without the patching blocks on every request.
+# CELERY_CONCURRENCY sets --concurrency when it is not given.
+# CELERY_PREFETCH_MULTIPLIER (default 1) sets how many tasks a worker reserves
+# per process or greenlet.
+if os.getenv("CELERY_QUEUES"):
+    celery_app.select_queues([queue.strip() for queue in os.getenv("CELERY_QUEUES").split(",")])
@@ -0,0 +1,56 @@
+from datetime import datetime
+from bson import ObjectId
+from elise.database import db
+from elise.indexes import ensure_indexes
+import sys
+
+# Run with: python check_indexes.py
+# Creates the declared indexes and checks with explain() that every query
+# shape issued by the routes and workers is served by an index rather than
+# a collection scan.
+
+QUERIES = [
+    # (description, collection, filter, sort)
+    ("login / current user", "users", {"email": "someone@example.com"}, None),
+    ("patient list", "patients", {"user_id": "user"}, None),
+    ("patient of a user", "patients", {"_id": ObjectId(), "user_id": "user"}, None),
+    ("consultation of a user", "consultations", {"consultation_id": "consultation", "user_id": "user"}, None),
+    ("consultations of a patient", "consultations", {"patient_id": "patient"}, None),
+    ("consultation resources", "consultation_resources", {"consultation_id": "consultation", "seq": {"$gt": 0}}, [("seq", 1)]),
+    ("consultation resources of a kind", "consultation_resources", {"consultation_id": "consultation", "seq": {"$gt": 0}, "kind": {"$in": ["transcript"]}}, [("seq", 1)]),
+    ("chat session", "chat_sessions", {"consultation_id": "consultation"}, None),
+    ("uploaded audio", "temp_files", {"file_id": "file"}, None),
+    ("expired uploads", "temp_files", {"created_at": {"$lt": datetime.utcnow()}}, None),
+    ("upload session", "upload_sessions", {"upload_id": "upload", "user_id": "user"}, None),
+    ("abandoned upload sessions", "upload_sessions", {"updated_at": {"$lt": datetime.utcnow()}}, None),
+    ("upload parts", "upload_parts", {"upload_id": "upload", "offset": {"$lt": 1}}, [("offset", 1)]),
+    ("transcription cache", "transcription_cache", {"_id": "hash"}, None),
+    ("membership quota", "memberships", {"user_id": "user"}, None),
+    ("tasks by id", "tasks", {"user_id": "user", "task_id": {"$in": ["task"]}}, [("created_at", -1)]),
+    ("tasks of a consultation", "tasks", {"user_id": "user", "consultation_id": "consultation", "state": {"$nin": ["done", "failed"]}}, [("created_at", -1)]),
+    ("task state", "tasks", {"task_id": "task", "state": {"$nin": ["done", "failed"]}}, None),
+]
+
+def plan_stages(plan: dict):
+    """Yield the stage names of an explain() plan tree"""
+    yield plan.get("stage")
+    for child in plan.get("inputStages", []) + [plan[key] for key in ("inputStage", "queryPlan") if key in plan]:
+        yield from plan_stages(child)
+
+def main():
+    failures = len(ensure_indexes())
+    for description, collection, query, sort in QUERIES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        winning_plan = cursor.explain()["queryPlanner"]["winningPlan"]
+        stages = set(plan_stages(winning_plan))
+        if "COLLSCAN" in stages:
+            failures += 1
+            print(f"FAIL {description}: {collection} {query} uses {sorted(stage for stage in stages if stage)}")
+        else:
+            print(f"OK   {description}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import math
+import os
+import time
+import redis.asyncio
+from .config import (
+    REDIS_URL,
+    ADMISSION_MAX_QUEUE_DEPTH,
+    ADMISSION_MAX_WAIT_SECONDS,
+    ADMISSION_MAX_TASKS_PER_USER,
+    ADMISSION_TASK_STALE_SECONDS
+)
+from .events import redis_client, async_redis_client
+
+# Admission control of the AI endpoints. Workers record the tasks running
+# per queue and how long the last ones took; the API combines that with the
+# depth of the queue in the broker to estimate how long a new task would
+# wait, and turns it away with a Retry-After when the queue is overloaded.
+# Every user can have at most ADMISSION_MAX_TASKS_PER_USER tasks queued or
+# running at once.
+
+# The broker keeps one Redis list per queue and message priority (see
+# broker_transport_options in task.py)
+BROKER_PRIORITY_STEPS = range(10)
+BROKER_PRIORITY_SEP = "\x06\x16"
+DURATION_SAMPLES = 50
+
+broker_client = redis.asyncio.Redis.from_url(os.getenv("CELERY_BROKER", REDIS_URL))
+
+class Overloaded(Exception):
+    """A request was not admitted; retry_after is the suggested wait in seconds"""
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def _running_key(queue: str):
+    return f"admission:running:{queue}"
+
+def _durations_key(queue: str):
+    return f"admission:durations:{queue}"
+
+def _user_key(user_id: str):
+    return f"admission:user:{user_id}"
+
+def _task_user(task_id: str):
+    return f"admission:task:{task_id}"
+
+# Count task ARGV[1] against the user's limit, unless the user is at it
+_ADMIT_USER_TASK = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', tonumber(ARGV[2]) - tonumber(ARGV[3]))
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[4]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('SET', KEYS[2], KEYS[1], 'EX', ARGV[3])
+return 1
+"""
+
+_admit_user_task = async_redis_client.register_script(_ADMIT_USER_TASK)
+
+async def queue_stats(queue: str):
+    """Depth, running tasks, average task time and estimated wait of a queue"""
+    pipe = broker_client.pipeline()
+    for priority in BROKER_PRIORITY_STEPS:
+        pipe.llen(f"{queue}{BROKER_PRIORITY_SEP}{priority}" if priority else queue)
+    depth = sum(await pipe.execute())
+
+    pipe = async_redis_client.pipeline()
+    pipe.zremrangebyscore(_running_key(queue), "-inf", time.time() - ADMISSION_TASK_STALE_SECONDS)
+    pipe.zcard(_running_key(queue))
+    pipe.lrange(_durations_key(queue), 0, -1)
+    _, running, durations = await pipe.execute()
+
+    average = sum(float(duration) for duration in durations) / len(durations) if durations else 0
+    return {
+        "depth": depth,
+        "running": running,
+        "average_task_seconds": round(average, 2),
+        # Running tasks show how many the queue's workers take at a time
+        "estimated_wait_seconds": round(depth * average / max(running, 1), 2)
+    }
+
+def _check_queue(queue: str, stats: dict):
+    per_task = stats["average_task_seconds"] / max(stats["running"], 1)
+    if stats["depth"] >= ADMISSION_MAX_QUEUE_DEPTH:
+        raise Overloaded(
+            f"The {queue} queue is full",
+            max(math.ceil((stats["depth"] - ADMISSION_MAX_QUEUE_DEPTH + 1) * per_task), 1)
+        )
+    max_wait = ADMISSION_MAX_WAIT_SECONDS.get(queue)
+    if max_wait is not None and stats["estimated_wait_seconds"] > max_wait:
+        raise Overloaded(
+            f"The {queue} queue is overloaded, estimated wait {math.ceil(stats['estimated_wait_seconds'])} s",
+            max(math.ceil(stats["estimated_wait_seconds"] - max_wait), 1)
+        )
+
+def _too_many_tasks(stats: dict):
+    return Overloaded(
+        f"Too many tasks in progress, at most {ADMISSION_MAX_TASKS_PER_USER} at a time",
+        max(math.ceil(stats["average_task_seconds"]), 1)
+    )
+
+async def check_capacity(queue: str, user_id: str):
+    """
+    Raise Overloaded if a new task of the user would not be admitted to the
+    queue right now, without reserving anything. Lets the endpoints turn a
+    request away before accepting a large upload; admit still decides.
+    """
+    stats = await queue_stats(queue)
+    _check_queue(queue, stats)
+    pipe = async_redis_client.pipeline()
+    pipe.zremrangebyscore(_user_key(user_id), "-inf", time.time() - ADMISSION_TASK_STALE_SECONDS)
+    pipe.zcard(_user_key(user_id))
+    _, user_tasks = await pipe.execute()
+    if user_tasks >= ADMISSION_MAX_TASKS_PER_USER:
+        raise _too_many_tasks(stats)
+
+async def admit(queue: str, user_id: str, task_id: str):
+    """
+    Admit a new task of the user to the queue, or raise Overloaded. An
+    admitted task counts against the user's limit until release_user_task.
+    """
+    stats = await queue_stats(queue)
+    _check_queue(queue, stats)
+    admitted = await _admit_user_task(
+        keys=[_user_key(user_id), _task_user(task_id)],
+        args=[task_id, time.time(), ADMISSION_TASK_STALE_SECONDS, ADMISSION_MAX_TASKS_PER_USER]
+    )
+    if not admitted:
+        raise _too_many_tasks(stats)
+    return stats
+
+async def release_admission(task_id: str):
+    """Stop counting a task that could not be enqueued against its user"""
+    user_key = await async_redis_client.get(_task_user(task_id))
+    if user_key:
+        await async_redis_client.zrem(user_key, task_id)
+        await async_redis_client.delete(_task_user(task_id))
+
+def release_user_task(task_id: str):
+    """Stop counting a finished task against its user"""
+    user_key = redis_client.get(_task_user(task_id))
+    if user_key:
+        redis_client.zrem(user_key, task_id)
+        redis_client.delete(_task_user(task_id))
+
+def task_started(task_id: str, queue: str):
+    redis_client.zadd(_running_key(queue), {task_id: time.time()})
+
+def task_finished(task_id: str, queue: str):
+    """Stop counting a task as running and remember how long it took"""
+    started_at = redis_client.zscore(_running_key(queue), task_id)
+    pipe = redis_client.pipeline()
+    pipe.zrem(_running_key(queue), task_id)
+    if started_at is not None:
+        pipe.lpush(_durations_key(queue), round(time.time() - started_at, 3))
+        pipe.ltrim(_durations_key(queue), 0, DURATION_SAMPLES - 1)
+    pipe.execute()
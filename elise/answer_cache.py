@@ -0,0 +1,80 @@
+import hashlib
+import re
+import time
+import unicodedata
+from .config import ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_MAX_ENTRIES
+from .database import db
+from .events import redis_client
+from .openai_helper import CHAT_MODEL, CHAT_INSTRUCTIONS, REPORT_INSTRUCTIONS, UPDATE_REPORT_INSTRUCTIONS
+
+# Chat answers and reports cached in Redis. The key combines the normalized
+# question, the model, a hash of the instructions and the consultation's
+# resource version (the seq of its last transcript, or for reports of its
+# last transcript or Q&A), so appending one makes every earlier entry
+# unreachable. Entries expire after ANSWER_CACHE_TTL_SECONDS and the least
+# recently used ones are evicted beyond ANSWER_CACHE_MAX_ENTRIES.
+
+ANSWER_CACHE_LRU = "answer_cache:lru"
+ANSWER_CACHE_STATS = "answer_cache:stats"
+
+_INSTRUCTIONS_VERSION = {
+    "chat": hashlib.sha256(CHAT_INSTRUCTIONS.encode()).hexdigest()[:12],
+    "report": hashlib.sha256((REPORT_INSTRUCTIONS + UPDATE_REPORT_INSTRUCTIONS).encode()).hexdigest()[:12],
+}
+
+def normalize_prompt(prompt: str):
+    """Lowercase, drop accents and punctuation and collapse whitespace"""
+    text = unicodedata.normalize("NFKD", prompt.casefold())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(re.findall(r"\w+", text))
+
+def resource_version(consultation_id: str, kinds: list):
+    """Seq of the consultation's last resource of the given kinds, 0 when it has none"""
+    last = db.consultation_resources.find_one(
+        {"consultation_id": consultation_id, "kind": {"$in": kinds}},
+        {"seq": 1},
+        sort=[("seq", -1)]
+    )
+    return last["seq"] if last else 0
+
+def answer_cache_key(kind: str, consultation_id: str, version: int, prompt: str = ""):
+    material = "\n".join([
+        kind,
+        CHAT_MODEL,
+        _INSTRUCTIONS_VERSION[kind],
+        consultation_id,
+        str(version),
+        normalize_prompt(prompt)
+    ])
+    return f"answer_cache:{hashlib.sha256(material.encode()).hexdigest()}"
+
+def get_cached_answer(key: str, kind: str):
+    """Return a cached answer or report, or None, counting hits and misses"""
+    answer = redis_client.get(key)
+    pipe = redis_client.pipeline()
+    if answer is None:
+        pipe.hincrby(ANSWER_CACHE_STATS, f"{kind}_misses", 1)
+    else:
+        pipe.hincrby(ANSWER_CACHE_STATS, f"{kind}_hits", 1)
+        pipe.zadd(ANSWER_CACHE_LRU, {key: time.time()})
+    pipe.execute()
+    return answer
+
+def store_answer(key: str, answer: str):
+    """Cache an answer or report and evict the least recently used entries beyond the limit"""
+    pipe = redis_client.pipeline()
+    pipe.set(key, answer, ex=ANSWER_CACHE_TTL_SECONDS)
+    pipe.zadd(ANSWER_CACHE_LRU, {key: time.time()})
+    # Entries that expired on their own no longer need tracking
+    pipe.zremrangebyscore(ANSWER_CACHE_LRU, 0, time.time() - ANSWER_CACHE_TTL_SECONDS)
+    pipe.zcard(ANSWER_CACHE_LRU)
+    size = pipe.execute()[-1]
+
+    excess = size - ANSWER_CACHE_MAX_ENTRIES
+    if excess > 0:
+        oldest = [key for key, _ in redis_client.zpopmin(ANSWER_CACHE_LRU, excess)]
+        redis_client.delete(*oldest)
+
+def answer_cache_stats():
+    """Hit and miss counters per kind"""
+    return {field: int(value) for field, value in redis_client.hgetall(ANSWER_CACHE_STATS).items()}
@@ -0,0 +1,279 @@
+import difflib
+import hashlib
+import re
+import subprocess
+import threading
+import numpy as np
+from .storage import AudioSpool
+
+# Audio is analysed as 16 kHz mono signed 16-bit PCM
+SAMPLE_RATE = 16000
+FRAME_SECONDS = 0.03
+
+# Normalized audio sent to the transcription API is Opus in an Ogg container
+NORMALIZED_EXTENSION = ".ogg"
+
+PIPE_BLOCK_SIZE = 1024 * 1024
+
+def _run_ffmpeg(args, output, feed=None):
+    """
+    Run ffmpeg with the blocks of feed (if any) on stdin and copy its stdout
+    into output, so neither side needs a file on disk
+    """
+    process = subprocess.Popen(
+        ["ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error", *args],
+        stdin=subprocess.PIPE if feed is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE
+    )
+    
+    def write_feed():
+        try:
+            for block in feed:
+                process.stdin.write(block)
+        except BrokenPipeError:
+            pass
+        finally:
+            process.stdin.close()
+    
+    writer = None
+    if feed is not None:
+        writer = threading.Thread(target=write_feed, daemon=True)
+        writer.start()
+    for chunk in iter(lambda: process.stdout.read(PIPE_BLOCK_SIZE), b""):
+        output.write(chunk)
+    if writer:
+        writer.join()
+    if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, "ffmpeg")
+    return output
+
+def decode_to_pcm(source: AudioSpool):
+    """
+    Decode any audio ffmpeg understands into raw 16 kHz mono PCM.
+    In-memory sources are piped in; sources already on disk are read in place.
+    """
+    pcm_args = ["-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le", "pipe:1"]
+    if source.path:
+        return _run_ffmpeg(["-i", source.path, *pcm_args], AudioSpool())
+    
+    try:
+        return _run_ffmpeg(["-i", "pipe:0", *pcm_args], AudioSpool(), feed=source.blocks())
+    except subprocess.CalledProcessError:
+        # Some containers (e.g. non-fragmented MP4) can only be read seekably
+        source.move_to_disk()
+        return _run_ffmpeg(["-i", source.path, *pcm_args], AudioSpool())
+
+def pcm_samples(pcm: AudioSpool):
+    """
+    View raw PCM as an int16 array, memory-mapped when it was spooled to disk
+    """
+    if not pcm.size():
+        return np.zeros(0, dtype=np.int16)
+    if pcm.path:
+        return np.memmap(pcm.path, dtype=np.int16, mode="r")
+    return np.frombuffer(pcm.file.getvalue(), dtype=np.int16)
+
+def _sample_blocks(samples):
+    block_size = SAMPLE_RATE * 10
+    for first in range(0, len(samples), block_size):
+        yield np.ascontiguousarray(samples[first:first + block_size], dtype=np.int16).tobytes()
+
+def frame_energies(samples, frame_seconds: float = FRAME_SECONDS):
+    """
+    Compute the RMS energy of every frame, reading the samples block by block
+    """
+    frame_size = int(SAMPLE_RATE * frame_seconds)
+    frame_count = len(samples) // frame_size
+    energies = np.zeros(frame_count, dtype=np.float32)
+    frames_per_block = 2000
+    for first in range(0, frame_count, frames_per_block):
+        last = min(first + frames_per_block, frame_count)
+        block = np.asarray(samples[first * frame_size:last * frame_size], dtype=np.float32)
+        block = block.reshape(last - first, frame_size)
+        energies[first:last] = np.sqrt(np.mean(block * block, axis=1))
+    return energies
+
+def pcm_sha256(samples):
+    """
+    Hash int16 samples block by block, used as the content address of audio
+    """
+    sha256 = hashlib.sha256()
+    for block in _sample_blocks(samples):
+        sha256.update(block)
+    return sha256.hexdigest()
+
+def speech_threshold(energies, ratio: float, min_rms: float, calibration_seconds: float, frame_seconds: float = FRAME_SECONDS):
+    """
+    Estimate the energy above which a frame counts as speech.
+    The noise floor is measured on the first calibration_seconds only, so
+    appending audio to a recording does not move the threshold.
+    """
+    calibration = energies[:max(int(calibration_seconds / frame_seconds), 1)]
+    if not len(calibration):
+        return min_rms
+    floor = float(np.percentile(calibration, 10))
+    peak = float(np.percentile(calibration, 90))
+    # Never call most of the calibration audio silence
+    return min(max(floor * ratio, min_rms), max((floor + peak) / 2, min_rms))
+
+def detect_speech(energies, threshold: float, min_silence_seconds: float, padding_seconds: float, frame_seconds: float = FRAME_SECONDS):
+    """
+    Find speech regions as (start, end) seconds. Silences shorter than
+    min_silence_seconds are kept inside a region and every region is padded
+    so word onsets and endings are not clipped.
+    """
+    speech_frames = np.flatnonzero(energies > threshold)
+    if not len(speech_frames):
+        return []
+
+    min_gap = int(min_silence_seconds / frame_seconds)
+    gaps = np.flatnonzero(np.diff(speech_frames) > min_gap)
+    starts = np.concatenate(([speech_frames[0]], speech_frames[gaps + 1]))
+    ends = np.concatenate((speech_frames[gaps], [speech_frames[-1]])) + 1
+
+    padding = int(padding_seconds / frame_seconds)
+    regions = []
+    for start, end in zip(starts, ends):
+        start = max(int(start) - padding, 0)
+        end = min(int(end) + padding, len(energies))
+        if regions and start <= regions[-1][1]:
+            regions[-1][1] = end
+        else:
+            regions.append([start, end])
+    return [(start * frame_seconds, end * frame_seconds) for start, end in regions]
+
+def compact_speech(samples, regions):
+    """
+    Keep only the speech regions of a recording.
+    Returns the compacted samples and an offset map of
+    [compact_start, original_start, duration] entries in seconds.
+    """
+    offset_map = []
+    compact_start = 0.0
+    with AudioSpool() as pcm:
+        for start, end in regions:
+            first = int(start * SAMPLE_RATE)
+            last = min(int(end * SAMPLE_RATE), len(samples))
+            pcm.write(np.ascontiguousarray(samples[first:last], dtype=np.int16).tobytes())
+            duration = (last - first) / SAMPLE_RATE
+            offset_map.append([compact_start, first / SAMPLE_RATE, duration])
+            compact_start += duration
+        return pcm_samples(pcm), offset_map
+
+def to_original_time(offset_map, seconds: float):
+    """
+    Map a time in the compacted audio back to the original recording
+    """
+    for compact_start, original_start, duration in reversed(offset_map):
+        if seconds >= compact_start:
+            return original_start + min(seconds - compact_start, duration)
+    return seconds
+
+def find_split_points(energies, segment_seconds: float, search_seconds: float, frame_seconds: float = FRAME_SECONDS):
+    """
+    Pick cut times (in seconds) roughly every segment_seconds, moving each cut
+    to the quietest frame within search_seconds of its target.
+    The choice only depends on nearby audio, so the same recording always
+    produces the same cuts.
+    """
+    total_seconds = len(energies) * frame_seconds
+    cuts = []
+    last_cut = 0.0
+    while total_seconds - last_cut > segment_seconds:
+        target = last_cut + segment_seconds
+        first = int(max(last_cut + segment_seconds / 2, target - search_seconds) / frame_seconds)
+        last = max(int((target + search_seconds) / frame_seconds), first + 1)
+        window = energies[first:last]
+        cut = (first + int(np.argmin(window))) * frame_seconds if len(window) else target
+        cuts.append(cut)
+        last_cut = cut
+    return cuts
+
+def plan_segments(samples, segment_seconds: float, overlap_seconds: float, search_seconds: float, max_segments: int):
+    """
+    Split a recording into (start, end) second ranges cut at silence.
+    Each segment starts overlap_seconds before the previous cut so words at the
+    boundary are heard in full by at least one segment. If there would be more
+    than max_segments, the segments are made longer instead.
+    """
+    total_seconds = len(samples) / SAMPLE_RATE
+    if total_seconds <= segment_seconds:
+        return [(0.0, total_seconds)]
+
+    segment_seconds = max(segment_seconds, total_seconds / max_segments)
+    cuts = find_split_points(frame_energies(samples), segment_seconds, search_seconds)
+
+    segments = []
+    start = 0.0
+    for cut in cuts + [total_seconds]:
+        segments.append((max(start - overlap_seconds, 0.0), cut))
+        start = cut
+    return segments
+
+def encode_pcm(samples, bitrate: str):
+    """
+    Encode int16 mono samples as compact Opus audio in an Ogg container
+    """
+    return _run_ffmpeg(
+        [
+            "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "-i", "pipe:0",
+            "-c:a", "libopus", "-b:a", bitrate, "-application", "voip",
+            "-f", "ogg", "pipe:1"
+        ],
+        AudioSpool(),
+        feed=_sample_blocks(samples)
+    )
+
+def _normalize_word(word: str):
+    return re.sub(r"[^\w]", "", word.lower())
+
+def _boundary_overlap(tail, head, edge_words: int, min_match_words: int):
+    """
+    Find the longest run of words that ends within edge_words of the end of
+    tail and starts within edge_words of the start of head, as (end in tail,
+    end in head), or None. Runs touching both edges exactly may be shorter.
+    """
+    best = None
+    best_size = 0
+    for head_start in range(min(edge_words, len(head)) + 1):
+        for tail_end in range(len(tail), max(len(tail) - edge_words, 0) - 1, -1):
+            size = min(tail_end, len(head) - head_start)
+            while size and tail[tail_end - size:tail_end] != head[head_start:head_start + size]:
+                size -= 1
+            exact = head_start == 0 and tail_end == len(tail)
+            if size > best_size and (size >= min_match_words or (exact and size >= 2)):
+                best = (tail_end, head_start + size)
+                best_size = size
+    return best
+
+def merge_transcripts(pieces, overlap_words: int = 30, edge_words: int = 3, min_match_words: int = 3):
+    """
+    Stitch consecutive segment transcripts into one text.
+    The end of each piece and the start of the next were transcribed from the
+    same overlapping audio, so a run of words shared by both right at the
+    boundary is kept once. Whisper often garbles a few words at the edges of
+    a chunk, so the run may end up to edge_words before the end of the piece
+    and start up to edge_words into the next one, and those words are
+    dropped. Without such a run the next piece is appended as it is: common
+    word pairs elsewhere in the overlap must not count as the seam.
+    """
+    merged = []
+    for piece in pieces:
+        words = piece.split()
+        if not merged:
+            merged = words
+            continue
+
+        tail = merged[-overlap_words:]
+        overlap = _boundary_overlap(
+            [_normalize_word(word) for word in tail],
+            [_normalize_word(word) for word in words[:overlap_words]],
+            edge_words,
+            min_match_words
+        )
+        if overlap:
+            tail_end, head_end = overlap
+            merged = merged[:len(merged) - len(tail) + tail_end] + words[head_end:]
+        else:
+            merged = merged + words
+    return " ".join(merged)
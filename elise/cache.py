@@ -0,0 +1,54 @@
+from datetime import datetime
+from .config import TRANSCRIPTION_CACHE_MAX_ENTRIES
+from .database import db
+
+# Transcripts keyed by the SHA-256 of the normalized audio they came from.
+# Entries expire through the TTL index on last_used (see indexes.py) and
+# the least recently used ones are evicted beyond the maximum entry count.
+
+def get_cached_transcript(audio_hash: str):
+    """Return the cached transcript for an audio hash, or None"""
+    entry = db.transcription_cache.find_one_and_update(
+        {"_id": audio_hash},
+        {"$set": {"last_used": datetime.utcnow()}, "$inc": {"hits": 1}},
+        projection={"text": 1}
+    )
+    return entry["text"] if entry else None
+
+def store_transcript(audio_hash: str, text: str):
+    """Cache a transcript and evict the oldest entries beyond the size limit"""
+    now = datetime.utcnow()
+    db.transcription_cache.update_one(
+        {"_id": audio_hash},
+        {
+            "$set": {"text": text, "size": len(text.encode()), "last_used": now},
+            "$setOnInsert": {"created_at": now, "hits": 0}
+        },
+        upsert=True
+    )
+    
+    excess = db.transcription_cache.estimated_document_count() - TRANSCRIPTION_CACHE_MAX_ENTRIES
+    if excess > 0:
+        oldest = db.transcription_cache.find({}, {"_id": 1}).sort("last_used", 1).limit(excess)
+        db.transcription_cache.delete_many({"_id": {"$in": [entry["_id"] for entry in oldest]}})
+
+# Summaries of context chunks keyed by the SHA-256 of the chunk text, so a
+# long consultation only summarizes each part of its history once. Entries
+# expire through the TTL index on last_used like cached transcripts.
+
+def get_cached_summary(text_hash: str):
+    """Return the cached summary of a context chunk, or None"""
+    entry = db.summary_cache.find_one_and_update(
+        {"_id": text_hash},
+        {"$set": {"last_used": datetime.utcnow()}},
+        projection={"summary": 1}
+    )
+    return entry["summary"] if entry else None
+
+def store_summary(text_hash: str, summary: str):
+    """Cache the summary of a context chunk"""
+    db.summary_cache.update_one(
+        {"_id": text_hash},
+        {"$set": {"summary": summary, "last_used": datetime.utcnow()}},
+        upsert=True
+    )
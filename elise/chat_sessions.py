@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta
+from .config import CHAT_SESSION_IDLE_SECONDS, CHAT_SESSION_MAX_TURNS
+from .database import db
+
+# One chat session per consultation. It remembers the OpenAI response to
+# continue from and the seq of the last resource already sent, so a
+# follow-up question only sends the question and the resources added since.
+# The chat_sessions documents expire through a TTL index on updated_at.
+
+def get_chat_session(consultation_id: str):
+    """Return the consultation's chat session, or None when there is none or it went stale"""
+    session = db.chat_sessions.find_one({"consultation_id": consultation_id})
+    if not session:
+        return None
+    if session["updated_at"] < datetime.utcnow() - timedelta(seconds=CHAT_SESSION_IDLE_SECONDS):
+        return None
+    if session["turns"] >= CHAT_SESSION_MAX_TURNS:
+        return None
+    return session
+
+def save_chat_session(consultation_id: str, response_id: str, context_seq: int, turns: int):
+    db.chat_sessions.update_one(
+        {"consultation_id": consultation_id},
+        {"$set": {
+            "response_id": response_id,
+            "context_seq": context_seq,
+            "turns": turns,
+            "updated_at": datetime.utcnow()
+        }},
+        upsert=True
+    )
+
+def reset_chat_session(consultation_id: str):
+    db.chat_sessions.delete_one({"consultation_id": consultation_id})
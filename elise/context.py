@@ -0,0 +1,137 @@
+import hashlib
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from .cache import get_cached_summary, store_summary
+from .config import CONTEXT_TOKEN_BUDGET, CONTEXT_CHUNK_TOKENS, CONTEXT_VERBATIM_SHARE
+from .openai_helper import summarize_text
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # Fall back to the ~4 characters per token estimate
+        return None
+
+def count_tokens(text: str):
+    """Count the tokens of a text as the OpenAI models see them"""
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+def split_tokens(text: str, max_tokens: int):
+    """Split a text into pieces of at most max_tokens tokens"""
+    if count_tokens(text) <= max_tokens:
+        return [text]
+    encoding = _get_encoding()
+    if encoding is None:
+        size = max_tokens * 4
+        return [text[first:first + size] for first in range(0, len(text), size)]
+    tokens = encoding.encode(text)
+    return [encoding.decode(tokens[first:first + max_tokens]) for first in range(0, len(tokens), max_tokens)]
+
+def format_resource(resource: dict):
+    """
+    Format one transcript or Q&A resource as prompt text ("" for other kinds)
+    """
+    if resource["kind"] == "transcript":
+        return f"Transcripción ({resource['created_at']}): {resource['text']}\n\n"
+    if resource["kind"] == "question":
+        return f"Pregunta: {resource['question']}\nRespuesta: {resource['text']}\n\n"
+    return ""
+
+def format_resources(resources: list):
+    """Concatenate transcript and Q&A resources into a single prompt text"""
+    return "".join(format_resource(resource) for resource in resources)
+
+def _keywords(text: str):
+    return {word for word in re.findall(r"\w+", text.lower()) if len(word) > 3}
+
+def _chunk(counts: list, chunk_tokens: int):
+    """
+    Group consecutive pieces into chunks of about chunk_tokens. Appending
+    pieces only ever changes the last chunk, so earlier chunks stay cacheable.
+    """
+    chunks = [[]]
+    used = 0
+    for index, count in enumerate(counts):
+        if chunks[-1] and used + count > chunk_tokens:
+            chunks.append([])
+            used = 0
+        chunks[-1].append(index)
+        used += count
+    return chunks
+
+def _summarize(text: str):
+    text_hash = hashlib.sha256(text.encode()).hexdigest()
+    summary = get_cached_summary(text_hash)
+    if summary is None:
+        summary = summarize_text(text)
+        store_summary(text_hash, summary)
+    return summary
+
+def _map_summaries(texts: list):
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        return list(executor.map(_summarize, texts))
+
+def _reduce(summaries: list, budget: int):
+    """
+    Summarize groups of summaries until they fit in the budget
+    """
+    while len(summaries) > 1 and sum(count_tokens(summary) for summary in summaries) > budget:
+        chunks = _chunk([count_tokens(summary) for summary in summaries], CONTEXT_CHUNK_TOKENS)
+        if len(chunks) == len(summaries):
+            # Every summary fills a chunk on its own, combine them in pairs
+            chunks = [list(range(first, min(first + 2, len(summaries)))) for first in range(0, len(summaries), 2)]
+        summaries = _map_summaries(["\n\n".join(summaries[index] for index in chunk) for chunk in chunks])
+    return split_tokens("\n\n".join(summaries), budget)[0] if summaries else ""
+
+def assemble_context(resources: list, question: str = None, budget: int = CONTEXT_TOKEN_BUDGET):
+    """
+    Build the prompt context for a consultation within a token budget.
+    When every resource fits it is sent verbatim. Otherwise the most recent
+    resources (and those sharing the most words with the question) are kept
+    verbatim in CONTEXT_VERBATIM_SHARE of the budget and the rest of the
+    history is summarized chunk by chunk (map) and, if needed, the summaries
+    are summarized again (reduce). Chunk summaries are cached.
+    """
+    pieces = []
+    for resource in resources:
+        text = format_resource(resource)
+        if text:
+            pieces.extend(split_tokens(text, CONTEXT_CHUNK_TOKENS))
+    counts = [count_tokens(piece) for piece in pieces]
+    if sum(counts) <= budget:
+        return "".join(pieces)
+    
+    # Rank pieces by relevance to the question, then by recency
+    keywords = _keywords(question) if question else set()
+    def score(index):
+        relevance = len(keywords & _keywords(pieces[index])) / len(keywords) if keywords else 0
+        recency = (index + 1) / len(pieces)
+        return 2 * relevance + recency
+    
+    verbatim = set()
+    used = 0
+    for index in sorted(range(len(pieces)), key=score, reverse=True):
+        if used + counts[index] <= budget * CONTEXT_VERBATIM_SHARE:
+            verbatim.add(index)
+            used += counts[index]
+    
+    # Summarize what every chunk holds beyond the pieces kept verbatim. The
+    # chunks are cut over all pieces so their boundaries stay put as the
+    # consultation grows.
+    chunks = [
+        [index for index in chunk if index not in verbatim]
+        for chunk in _chunk(counts, CONTEXT_CHUNK_TOKENS)
+    ]
+    chunks = [chunk for chunk in chunks if chunk]
+    summaries = _map_summaries(["".join(pieces[index] for index in chunk) for chunk in chunks])
+    summary_text = _reduce(summaries, budget - used)
+    
+    verbatim_text = "".join(pieces[index] for index in sorted(verbatim))
+    print(f"Context reduced from {sum(counts)} tokens: {len(verbatim)} resources verbatim, {len(summaries)} chunks summarized")
+    return f"Resumen de la consulta:\n{summary_text}\n\n{verbatim_text}"
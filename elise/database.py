@@ -1,5 +1,10 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, AsyncMongoClient
 from .config import MONGO_URI, MONGO_DB_NAME
 
+# Celery workers and scripts use the blocking client
 client = MongoClient(MONGO_URI)
 db = client[MONGO_DB_NAME]
+
+# Routes use the async client so a slow query never blocks the event loop
+async_client = AsyncMongoClient(MONGO_URI)
+async_db = async_client[MONGO_DB_NAME]
@@ -2,12 +2,13 @@ from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from elise.utils.auth import decode_access_token
 from elise.models import TokenData
+from elise.config import ADMIN_EMAILS
 from jose import JWTError
-from elise.database import db
+from elise import repositories
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/elise/auth/token")
 
-def get_current_user(token: str = Depends(oauth2_scheme)):
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(status_code=401, detail="Could not validate credentials")
     try:
         payload = decode_access_token(token)
@@ -17,7 +18,13 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
     except JWTError:
         raise credentials_exception
     
-    user = db.users.find_one({"email": email})
+    user = await repositories.find_user_by_email(email)
     if not user:
         raise credentials_exception
     return user
+
+async def get_current_admin(user: dict = Depends(get_current_user)):
+    """The current user, if listed in ADMIN_EMAILS"""
+    if user["email"].lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return user
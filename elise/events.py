@@ -0,0 +1,158 @@
+import json
+import time
+import redis
+import redis.asyncio
+from .config import REDIS_URL, STREAM_TTL_SECONDS
+
+# Workers publish with the blocking client, the API listens with the async one
+redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+async_redis_client = redis.asyncio.Redis.from_url(REDIS_URL, decode_responses=True)
+
+FINAL_STREAM_EVENTS = ("done", "error")
+
+def _stream_channel(task_id: str):
+    return f"stream:{task_id}"
+
+def _stream_log(task_id: str):
+    return f"stream:{task_id}:log"
+
+def _task_key(task_id: str):
+    return f"task:{task_id}"
+
+def _user_channel(user_id: str):
+    return f"tasks:{user_id}"
+
+def _user_recent(user_id: str):
+    return f"tasks:{user_id}:recent"
+
+def register_task(task_id: str, user_id: str, consultation_id: str, kind: str):
+    """
+    Remember who started a task, so its state changes and token stream
+    reach that user only, and announce it as queued
+    """
+    redis_client.hset(_task_key(task_id), mapping={
+        "user_id": user_id,
+        "consultation_id": consultation_id,
+        "kind": kind
+    })
+    redis_client.expire(_task_key(task_id), STREAM_TTL_SECONDS)
+    publish_task_event(task_id, "queued")
+
+async def get_task_owner(task_id: str):
+    return await async_redis_client.hget(_task_key(task_id), "user_id")
+
+def publish_task_event(task_id: str, state: str, **data):
+    """
+    Publish a state change (queued, started, progress, done, failed) of a
+    registered task on its user's channel. Unregistered tasks, such as the
+    segments of a long recording, are ignored.
+    """
+    task = redis_client.hgetall(_task_key(task_id))
+    if not task:
+        return
+    
+    user_id = task["user_id"]
+    message = json.dumps({
+        "task_id": task_id,
+        "kind": task["kind"],
+        "consultation_id": task["consultation_id"],
+        "state": state,
+        **data
+    })
+    now = time.time()
+    
+    # Keep the last event of every recent task for clients that reconnect
+    pipe = redis_client.pipeline()
+    pipe.hset(_task_key(task_id), "event", message)
+    pipe.zadd(_user_recent(user_id), {task_id: now})
+    pipe.zremrangebyscore(_user_recent(user_id), 0, now - STREAM_TTL_SECONDS)
+    pipe.expire(_user_recent(user_id), STREAM_TTL_SECONDS)
+    pipe.publish(_user_channel(user_id), message)
+    pipe.execute()
+
+def publish_stream_event(task_id: str, event: str, **data):
+    """
+    Append an event to a task's token stream and publish it.
+    Events are also kept in a list so a client that connects late can replay them.
+    """
+    message = {"event": event, **data}
+    seq = redis_client.rpush(_stream_log(task_id), json.dumps(message))
+    redis_client.expire(_stream_log(task_id), STREAM_TTL_SECONDS)
+    redis_client.publish(_stream_channel(task_id), json.dumps({**message, "seq": seq}))
+
+class TokenStream:
+    """
+    Callable passed to the OpenAI helpers to relay every text delta of a task
+    """
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+
+    def __call__(self, delta: str):
+        publish_stream_event(self.task_id, "delta", text=delta)
+
+    def done(self, text: str):
+        publish_stream_event(self.task_id, "done", text=text)
+
+    def error(self, detail: str):
+        publish_stream_event(self.task_id, "error", detail=detail)
+
+async def listen_stream(task_id: str, keepalive_seconds: float = 15):
+    """
+    Yield the events of a task's token stream from the beginning until it
+    is done, or None every keepalive_seconds while nothing happens
+    """
+    pubsub = async_redis_client.pubsub()
+    await pubsub.subscribe(_stream_channel(task_id))
+    try:
+        # Replay what was published before we subscribed
+        seq = 0
+        for raw in await async_redis_client.lrange(_stream_log(task_id), 0, -1):
+            seq += 1
+            message = json.loads(raw)
+            yield message
+            if message["event"] in FINAL_STREAM_EVENTS:
+                return
+        
+        while True:
+            raw = await pubsub.get_message(ignore_subscribe_messages=True, timeout=keepalive_seconds)
+            if raw is None:
+                yield None
+                continue
+            message = json.loads(raw["data"])
+            message_seq = message.pop("seq")
+            if message_seq <= seq:
+                continue
+            seq = message_seq
+            yield message
+            if message["event"] in FINAL_STREAM_EVENTS:
+                return
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.aclose()
+
+async def listen_task_events(user_id: str, keepalive_seconds: float = 15):
+    """
+    Yield the state changes of every task of a user, starting with the last
+    known state of their recent tasks, or None every keepalive_seconds while
+    nothing happens
+    """
+    pubsub = async_redis_client.pubsub()
+    await pubsub.subscribe(_user_channel(user_id))
+    try:
+        recent = await async_redis_client.zrangebyscore(
+            _user_recent(user_id), time.time() - STREAM_TTL_SECONDS, "+inf"
+        )
+        for task_id in recent:
+            raw = await async_redis_client.hget(_task_key(task_id), "event")
+            if raw:
+                yield json.loads(raw)
+        
+        while True:
+            raw = await pubsub.get_message(ignore_subscribe_messages=True, timeout=keepalive_seconds)
+            if raw is None:
+                yield None
+                continue
+            yield json.loads(raw["data"])
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.aclose()
@@ -0,0 +1,89 @@
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from .config import TEMP_FILE_TTL_SECONDS, TRANSCRIPTION_CACHE_TTL_SECONDS, SUMMARY_CACHE_TTL_SECONDS, CHAT_SESSION_IDLE_SECONDS
+from .database import db
+
+# Every index the routes and workers rely on, declared in one place and
+# created at startup. Each entry is (collection, keys, options); the index
+# name is given explicitly so it can be verified and changed later.
+INDEXES = [
+    # Login and every authenticated request look users up by email
+    ("users", [("email", ASCENDING)], {"name": "email_unique", "unique": True}),
+    # Patient list of a user
+    ("patients", [("user_id", ASCENDING)], {"name": "user_id"}),
+    # Consultation lookups by id (always together with user_id, which the
+    # unique index already narrows down to one document) and by patient
+    ("consultations", [("consultation_id", ASCENDING)], {"name": "consultation_id_unique", "unique": True}),
+    ("consultations", [("patient_id", ASCENDING)], {"name": "patient_id"}),
+    # Resources of a consultation in order, optionally of some kinds
+    ("consultation_resources", [("consultation_id", ASCENDING), ("seq", ASCENDING)], {"name": "consultation_seq_unique", "unique": True}),
+    ("consultation_resources", [("consultation_id", ASCENDING), ("kind", ASCENDING), ("seq", ASCENDING)], {"name": "consultation_kind_seq"}),
+    # Chat sessions, dropped once idle
+    ("chat_sessions", [("consultation_id", ASCENDING)], {"name": "consultation_id_unique", "unique": True}),
+    ("chat_sessions", [("updated_at", ASCENDING)], {"name": "updated_at_ttl", "expireAfterSeconds": CHAT_SESSION_IDLE_SECONDS}),
+    # Uploaded audio metadata expires on its own once transcribed or abandoned
+    ("temp_files", [("file_id", ASCENDING)], {"name": "file_id_unique", "unique": True}),
+    ("temp_files", [("created_at", ASCENDING)], {"name": "created_at_ttl", "expireAfterSeconds": TEMP_FILE_TTL_SECONDS}),
+    # Resumable uploads
+    ("upload_sessions", [("upload_id", ASCENDING)], {"name": "upload_id_unique", "unique": True}),
+    ("upload_sessions", [("updated_at", ASCENDING)], {"name": "updated_at"}),
+    ("upload_parts", [("upload_id", ASCENDING), ("offset", ASCENDING)], {"name": "upload_id_offset_unique", "unique": True}),
+    # Cached transcripts expire once unused for a while
+    ("transcription_cache", [("last_used", ASCENDING)], {"name": "last_used_ttl", "expireAfterSeconds": TRANSCRIPTION_CACHE_TTL_SECONDS}),
+    # Cached context summaries of patient transcripts, likewise
+    ("summary_cache", [("last_used", ASCENDING)], {"name": "last_used_ttl", "expireAfterSeconds": SUMMARY_CACHE_TTL_SECONDS}),
+    # Membership of a user, loaded and synced for the AI request quota
+    ("memberships", [("user_id", ASCENDING)], {"name": "user_id"}),
+    # Task registry, by id and per user and consultation
+    ("tasks", [("task_id", ASCENDING)], {"name": "task_id_unique", "unique": True}),
+    ("tasks", [("user_id", ASCENDING), ("consultation_id", ASCENDING), ("created_at", DESCENDING)], {"name": "user_consultation_created"}),
+]
+
+def _same_key(existing: dict, keys: list):
+    return [(field, direction) for field, direction in existing["key"]] == keys
+
+def _find_index(collection: str, keys: list):
+    """Return the name and description of the existing index on keys, or None"""
+    for name, info in db[collection].index_information().items():
+        if _same_key(info, keys):
+            return name, info
+    return None
+
+def ensure_indexes():
+    """
+    Create every declared index and verify it afterwards. An index that
+    exists with a different TTL is updated in place; any other conflict is
+    reported and left for a manual migration.
+    Returns a list of problems, empty when everything is in place.
+    """
+    problems = []
+    for collection, keys, options in INDEXES:
+        existing = _find_index(collection, keys)
+        if existing and "expireAfterSeconds" in options:
+            name, info = existing
+            if info.get("expireAfterSeconds") != options["expireAfterSeconds"]:
+                try:
+                    db.command("collMod", collection, index={"name": name, "expireAfterSeconds": options["expireAfterSeconds"]})
+                    print(f"Updated TTL of {collection}.{name} to {options['expireAfterSeconds']}s")
+                except OperationFailure as e:
+                    problems.append(f"{collection}.{name}: {e}")
+            continue
+        if existing:
+            # Already there, possibly under another name
+            name, info = existing
+            if bool(info.get("unique")) != bool(options.get("unique")):
+                problems.append(f"{collection}.{name} exists with unique={bool(info.get('unique'))}")
+            continue
+
+        try:
+            db[collection].create_index(keys, **options)
+        except OperationFailure as e:
+            problems.append(f"{collection}.{options['name']}: {e}")
+            continue
+
+        if not _find_index(collection, keys):
+            problems.append(f"{collection}.{options['name']} was not created")
+
+    for problem in problems:
+        print(f"Index problem: {problem}")
+    return problems
@@ -1,9 +1,18 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from starlette.concurrency import run_in_threadpool
 from .config import ROOT_PATH
+from .indexes import ensure_indexes
 from .routes import api_users, api_membership, views, api_ai
 from fastapi.staticfiles import StaticFiles
 
-app = FastAPI(root_path=ROOT_PATH)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Make sure every index the routes rely on exists before serving
+    await run_in_threadpool(ensure_indexes)
+    yield
+
+app = FastAPI(root_path=ROOT_PATH, lifespan=lifespan)
 
 from .routes import api_users, api_membership, views, api_auth, api_patients, api_consultations, api_ai
 app.include_router(api_users.router)
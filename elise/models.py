@@ -51,7 +51,9 @@ class TempFile(BaseModel):
     user_id: str
     filename: str
     content_type: str
-    file_data: bytes
+    blob_id: str
+    length: int
+    sha256: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class ConsultationCreate(BaseModel):
@@ -60,7 +62,6 @@ class ConsultationCreate(BaseModel):
     time: str
     description: str
     report_txt: str = ""
-    resources: List[str] = []
 
 class Consultation(BaseModel):
     consultation_id: str
@@ -70,5 +71,5 @@ class Consultation(BaseModel):
     time: str
     description: str
     report_txt: str = ""
-    resources: List[str] = []
+    resource_count: int = 0
 
@@ -1,52 +1,235 @@
 import openai
+import httpx
 import os
+import random
+import threading
 import time
+from contextlib import contextmanager
+from functools import wraps
 from dotenv import load_dotenv
+from . import rate_limiter
+from .config import (
+    OPENAI_HTTP2,
+    OPENAI_MAX_CONNECTIONS,
+    OPENAI_MAX_CONCURRENCY,
+    OPENAI_CONNECT_TIMEOUT_SECONDS,
+    OPENAI_TIMEOUT_SECONDS,
+    OPENAI_CHAT_RPM,
+    OPENAI_CHAT_TPM,
+    OPENAI_TRANSCRIPTION_RPM,
+    OPENAI_EXPECTED_OUTPUT_TOKENS,
+    OPENAI_MAX_RETRIES
+)
 
 load_dotenv()
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+def _http2_available():
+    try:
+        import h2
+        return True
+    except ImportError:
+        return False
+
+# One client per process with a pooled keep-alive transport, shared by every
+# task (or greenlet, with the gevent pool) running in it
+client = openai.OpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    http_client=httpx.Client(
+        http2=OPENAI_HTTP2 and _http2_available(),
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_CONNECTIONS
+        ),
+        timeout=httpx.Timeout(OPENAI_TIMEOUT_SECONDS, connect=OPENAI_CONNECT_TIMEOUT_SECONDS)
+    ),
+    # Retries are handled by with_retry
+    max_retries=0
+)
+
+_concurrency = threading.BoundedSemaphore(OPENAI_MAX_CONCURRENCY)
+
+TRANSCRIPTION_MODEL = "whisper-1"
+CHAT_MODEL = "gpt-4-turbo"
+
+# Requests and tokens per minute of every model used
+RATE_LIMITS = {
+    TRANSCRIPTION_MODEL: (OPENAI_TRANSCRIPTION_RPM, 0),
+    CHAT_MODEL: (OPENAI_CHAT_RPM, OPENAI_CHAT_TPM),
+}
+
+def _retry_after(error: openai.APIStatusError):
+    """Seconds the API asked to wait before retrying, or None"""
+    headers = error.response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+@contextmanager
+def _request_slot(model: str, tokens: int = 0):
+    """
+    Wait for the model's shared rate limits to allow the request, then hold
+    one of the process's OpenAI request slots. A 429 pauses the model for
+    every worker.
+    """
+    rate_limiter.acquire(model, *RATE_LIMITS[model], tokens)
+    with _concurrency:
+        try:
+            yield
+        except openai.RateLimitError as e:
+            rate_limiter.pause(model, _retry_after(e) or 1)
+            raise
 
 def with_retry(func):
+    """Retry rate limited calls, waiting as long as the API asks to"""
+    @wraps(func)
     def wrapper(*args, **kwargs):
-        retries = 3
-        delay = 2
-        for i in range(retries):
+        for attempt in range(OPENAI_MAX_RETRIES + 1):
             try:
                 return func(*args, **kwargs)
-            except openai.error.RateLimitError:
-                time.sleep(delay)
-                delay *= 2
-        raise Exception("Max retries exceeded")
+            except openai.RateLimitError as e:
+                # An exhausted quota does not come back by waiting
+                if e.code == "insufficient_quota" or attempt == OPENAI_MAX_RETRIES:
+                    raise
+                # With a Retry-After the next call waits out the pause shared by
+                # every worker, otherwise back off exponentially
+                if _retry_after(e) is None:
+                    time.sleep(2 ** attempt * random.uniform(1, 1.5))
     return wrapper
 
+def _create_transcription(audio, filename: str):
+    with _request_slot(TRANSCRIPTION_MODEL):
+        raw = client.audio.transcriptions.with_raw_response.create(
+            model=TRANSCRIPTION_MODEL,
+            file=(filename, audio)
+        )
+    rate_limiter.sync_with_headers(TRANSCRIPTION_MODEL, raw.headers)
+    return raw.parse().text
+
 @with_retry
-def transcribe_audio(file_path: str):
-    with open(file_path, "rb") as f:
-        transcript = openai.audio.transcriptions.create(
-            model="whisper-1",
-            file=f
+def transcribe_audio(audio, filename: str = "audio.webm"):
+    """
+    Transcribe audio given as a file path, bytes, a memoryview or a readable
+    file object. The filename tells the API which format the audio is in.
+    """
+    if isinstance(audio, (str, os.PathLike)):
+        with open(audio, "rb") as f:
+            return _create_transcription(f, os.path.basename(audio))
+    
+    if isinstance(audio, (bytearray, memoryview)):
+        audio = bytes(audio)
+    elif hasattr(audio, "seek"):
+        # Rewind so a retried call sends the whole stream again
+        audio.seek(0)
+    
+    return _create_transcription(audio, filename)
+
+def _estimate_tokens(*texts: str):
+    """Rough token count of a request and its answer, reserved until the actual usage is known"""
+    # ~4 characters per token, as context.count_tokens falls back to
+    return sum(len(text) for text in texts) // 4 + OPENAI_EXPECTED_OUTPUT_TOKENS
+
+def _create_response(instructions: str, prompt: str, on_delta=None, previous_response_id: str = None):
+    """
+    Run a Responses API call, continuing the conversation of
+    previous_response_id if given. With on_delta the response is streamed and
+    every text delta is passed to on_delta as it arrives.
+    Returns the output text and the response id.
+    """
+    reserved = _estimate_tokens(instructions, prompt)
+    if on_delta is None:
+        with _request_slot(CHAT_MODEL, reserved):
+            raw = client.responses.with_raw_response.create(
+                model=CHAT_MODEL,
+                instructions=instructions,
+                input=prompt,
+                previous_response_id=previous_response_id or openai.NOT_GIVEN
+            )
+        rate_limiter.sync_with_headers(CHAT_MODEL, raw.headers)
+        response = raw.parse()
+        rate_limiter.settle_tokens(CHAT_MODEL, reserved, response.usage.total_tokens if response.usage else None)
+        return response.output_text, response.id
+    
+    output_text = ""
+    response_id = None
+    used = None
+    # The slot is held until the whole answer is streamed
+    with _request_slot(CHAT_MODEL, reserved):
+        raw = client.responses.with_raw_response.create(
+            model=CHAT_MODEL,
+            instructions=instructions,
+            input=prompt,
+            previous_response_id=previous_response_id or openai.NOT_GIVEN,
+            stream=True
         )
-    return transcript.text
+        rate_limiter.sync_with_headers(CHAT_MODEL, raw.headers)
+        for event in raw.parse():
+            if event.type == "response.created":
+                response_id = event.response.id
+            elif event.type == "response.output_text.delta":
+                output_text += event.delta
+                on_delta(event.delta)
+            elif event.type == "response.completed" and event.response.usage:
+                used = event.response.usage.total_tokens
+    rate_limiter.settle_tokens(CHAT_MODEL, reserved, used)
+    return output_text, response_id
+
+def _respond(instructions: str, prompt: str, on_delta=None):
+    return _create_response(instructions, prompt, on_delta)[0]
+
+CHAT_INSTRUCTIONS = "Using the provided information, answer the question presented at the end. Write in spanish. The user is a medical professional and will use the answer as a reference for the patient." # TODO: add instructions
+REPORT_INSTRUCTIONS = "You are a medical professional assistant. Create a comprehensive summary in Spanish of the provided medical consultation information. Focus on key findings, patient symptoms, and important details."
+UPDATE_REPORT_INSTRUCTIONS = "You are a medical professional assistant. Keep a comprehensive summary in Spanish of a medical consultation up to date. Integrate the new information into the existing report, focusing on key findings, patient symptoms, and important details. Return the complete updated report."
 
 @with_retry
-def complete_chat(prompt: str):
-    response = openai.responses.create(
-        model="gpt-4-turbo",
-        instructions="Using the provided information, answer the question presented at the end. Write in spanish. The user is a medical professional and will use the answer as a reference for the patient.", # TODO: add instructions
-        input=prompt
-    )
-    return response.output_text
+def complete_chat(prompt: str, on_delta=None):
+    return _respond(CHAT_INSTRUCTIONS, prompt, on_delta)
+
+class ConversationExpired(Exception):
+    """The response a conversation should continue from no longer exists"""
+
+@with_retry
+def continue_chat(prompt: str, previous_response_id: str = None, on_delta=None):
+    """
+    Ask a question in the conversation of previous_response_id (a new one
+    when None), whose earlier turns OpenAI keeps server side.
+    Returns the answer and the id of the response to continue from next.
+    """
+    try:
+        return _create_response(CHAT_INSTRUCTIONS, prompt, on_delta, previous_response_id)
+    except (openai.NotFoundError, openai.BadRequestError) as e:
+        if previous_response_id and (isinstance(e, openai.NotFoundError) or e.param == "previous_response_id"):
+            raise ConversationExpired(previous_response_id) from e
+        raise
 
 @with_retry
-def create_report(resources_text: str):
+def create_report(resources_text: str, on_delta=None):
     """
     Create a summary report in Spanish from the given resources text
     """
     prompt = f"Summarize the given information. Write the summary in spanish. Use the information to create a report.\n\nInformation:\n{resources_text}"
     
-    response = openai.responses.create(
-        model="gpt-4-turbo",
-        instructions="You are a medical professional assistant. Create a comprehensive summary in Spanish of the provided medical consultation information. Focus on key findings, patient symptoms, and important details.",
-        input=prompt
+    return _respond(REPORT_INSTRUCTIONS, prompt, on_delta)
+
+@with_retry
+def update_report(report_text: str, new_resources_text: str, on_delta=None):
+    """
+    Merge newly added consultation information into an existing report in Spanish
+    """
+    prompt = f"Update the existing report with the new information. Keep everything in the report that is still valid and write it in spanish.\n\nExisting report:\n{report_text}\n\nNew information:\n{new_resources_text}"
+    
+    return _respond(UPDATE_REPORT_INSTRUCTIONS, prompt, on_delta)
+
+@with_retry
+def summarize_text(text: str):
+    """
+    Condense part of a consultation's history in Spanish, keeping clinical details
+    """
+    return _respond(
+        "You are a medical professional assistant. Condense the given part of a medical consultation in Spanish. Keep every symptom, finding, medication, dose, date and decision; drop small talk and repetitions.",
+        text
     )
-    return response.output_text
@@ -0,0 +1,179 @@
+from bson import ObjectId
+from pymongo import UpdateOne
+from .config import ADMISSION_TASK_STALE_SECONDS, QUOTA_NO_MEMBERSHIP_TTL_SECONDS
+from .database import db, async_db
+from .events import redis_client, async_redis_client
+
+# Per-user AI request quota: the available counter of the user's membership.
+# The API takes requests from a Redis copy of the counter atomically, a
+# task that fails gives its request back, and the sync_quotas task writes
+# the changed counters back to memberships in bulk. A counter missing from
+# Redis is loaded from the user's latest membership first and remembers
+# which membership it belongs to, so Redis holds the current value; a new
+# membership goes through reload_quota.
+#
+# A user without any membership has no AI requests: the AI endpoints answer
+# 403 (402 is for a membership that is used up). That is cached for
+# QUOTA_NO_MEMBERSHIP_TTL_SECONDS, so a membership inserted straight into
+# Mongo is picked up after that long.
+
+QUOTA_DIRTY = "quota:dirty"
+SYNC_BATCH_SIZE = 1000
+
+class QuotaExceeded(Exception):
+    """The user has no AI requests left"""
+
+class NoMembership(Exception):
+    """The user has no membership, so no AI requests at all"""
+
+def _quota_key(user_id: str):
+    return f"quota:{user_id}"
+
+def _task_charge(task_id: str):
+    return f"quota:task:{task_id}"
+
+def _membership_filter(user_id: str):
+    # create_user.py stores the user id as an ObjectId, the API as a string
+    user_ids = [user_id, ObjectId(user_id)] if ObjectId.is_valid(user_id) else [user_id]
+    return {"user_id": {"$in": user_ids}}
+
+# Take ARGV[1] requests from the counter KEYS[1] and remember the charge of
+# the task under KEYS[3]. Returns what is left, -1 when not enough is
+# available, -2 when the counter is not loaded and -3 when the user has no
+# membership.
+_CHARGE = async_redis_client.register_script("""
+local state = redis.call('HMGET', KEYS[1], 'available', 'membership_id')
+if not state[1] then
+    return -2
+end
+if state[2] == '' then
+    return -3
+end
+if tonumber(state[1]) < tonumber(ARGV[1]) then
+    return -1
+end
+local left = redis.call('HINCRBY', KEYS[1], 'available', -tonumber(ARGV[1]))
+redis.call('SADD', KEYS[2], ARGV[2])
+redis.call('HSET', KEYS[3], 'user_id', ARGV[2], 'cost', ARGV[1])
+redis.call('EXPIRE', KEYS[3], ARGV[3])
+return left
+""")
+
+# Load the counter KEYS[1] of membership ARGV[2] unless another request
+# loaded (and used) it meanwhile; ARGV[3] > 0 expires it
+_LOAD = async_redis_client.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'available', ARGV[1], 'membership_id', ARGV[2])
+if tonumber(ARGV[3]) > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+end
+return 1
+""")
+
+# Remove the counter KEYS[1] and return what it held
+_UNLOAD = async_redis_client.register_script("""
+local state = redis.call('HMGET', KEYS[1], 'available', 'membership_id')
+redis.call('DEL', KEYS[1])
+return state
+""")
+
+# Give a task's charge KEYS[1] back to the counter KEYS[2], once. A counter
+# that is not loaded was synced already, so there is nothing to give back to.
+_REFUND = """
+if redis.call('DEL', KEYS[1]) == 0 or redis.call('EXISTS', KEYS[2]) == 0 then
+    return 0
+end
+redis.call('HINCRBY', KEYS[2], 'available', ARGV[1])
+redis.call('SADD', KEYS[3], ARGV[2])
+return 1
+"""
+_async_refund = async_redis_client.register_script(_REFUND)
+_refund = redis_client.register_script(_REFUND)
+
+async def _load_quota(user_id: str):
+    membership = await async_db.memberships.find_one(
+        _membership_filter(user_id),
+        {"available": 1},
+        sort=[("_id", -1)]
+    )
+    if membership:
+        await _LOAD(keys=[_quota_key(user_id)], args=[membership["available"], str(membership["_id"]), 0])
+    else:
+        await _LOAD(keys=[_quota_key(user_id)], args=[0, "", QUOTA_NO_MEMBERSHIP_TTL_SECONDS])
+
+async def charge_quota(user_id: str, task_id: str, cost: int = 1):
+    """Take cost requests from the user's quota for a task, or raise QuotaExceeded or NoMembership"""
+    keys = [_quota_key(user_id), QUOTA_DIRTY, _task_charge(task_id)]
+    args = [cost, user_id, ADMISSION_TASK_STALE_SECONDS]
+    left = await _CHARGE(keys=keys, args=args)
+    if left == -2:
+        await _load_quota(user_id)
+        left = await _CHARGE(keys=keys, args=args)
+    if left == -3:
+        raise NoMembership("No membership, AI requests are not available")
+    if left < 0:
+        raise QuotaExceeded("No AI requests left in your membership")
+    return left
+
+async def reload_quota(user_id: str):
+    """
+    Switch the user's counter to their latest membership, e.g. when one is
+    created. What was left of the previous counter is written back to the
+    membership it came from first.
+    """
+    available, membership_id = await _UNLOAD(keys=[_quota_key(user_id)])
+    if membership_id:
+        await async_db.memberships.update_one(
+            {"_id": ObjectId(membership_id)},
+            {"$set": {"available": int(available)}}
+        )
+    await _load_quota(user_id)
+
+def _refund_charge(script, charge: dict, task_id: str):
+    return script(
+        keys=[_task_charge(task_id), _quota_key(charge["user_id"]), QUOTA_DIRTY],
+        args=[charge["cost"], charge["user_id"]]
+    )
+
+async def refund_quota_async(task_id: str):
+    """Give back the charge of a task that could not be enqueued"""
+    charge = await async_redis_client.hgetall(_task_charge(task_id))
+    if charge:
+        await _refund_charge(_async_refund, charge, task_id)
+
+def refund_quota(task_id: str):
+    """Give back the charge of a failed task"""
+    charge = redis_client.hgetall(_task_charge(task_id))
+    if charge:
+        _refund_charge(_refund, charge, task_id)
+
+def settle_quota(task_id: str):
+    """Keep the charge of a task that succeeded"""
+    redis_client.delete(_task_charge(task_id))
+
+def sync_quotas():
+    """Write the counters changed since the last sync back to their memberships"""
+    synced = 0
+    while True:
+        user_ids = redis_client.spop(QUOTA_DIRTY, SYNC_BATCH_SIZE)
+        if not user_ids:
+            return synced
+        pipe = redis_client.pipeline()
+        for user_id in user_ids:
+            pipe.hmget(_quota_key(user_id), "available", "membership_id")
+        operations = [
+            UpdateOne({"_id": ObjectId(membership_id)}, {"$set": {"available": int(available)}})
+            for available, membership_id in pipe.execute()
+            # Unloaded meanwhile (reload_quota wrote it back) or no membership
+            if membership_id
+        ]
+        try:
+            if operations:
+                db.memberships.bulk_write(operations, ordered=False)
+        except Exception:
+            # Try these users again on the next sync
+            redis_client.sadd(QUOTA_DIRTY, *user_ids)
+            raise
+        synced += len(operations)
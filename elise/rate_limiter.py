@@ -0,0 +1,126 @@
+import random
+import time
+from .config import OPENAI_RATE_LIMIT_MAX_WAIT_SECONDS
+from .events import redis_client
+
+# Token buckets in Redis shared by every worker, one per model, holding the
+# requests and tokens that may still be sent this minute. Both refill
+# continuously up to the per-minute limit. The rate limit headers of every
+# response bring the buckets down to what the API reports as remaining, and
+# a 429 pauses the model for all workers until its Retry-After has passed.
+
+class RateLimitTimeout(Exception):
+    """Capacity for a request did not free up within OPENAI_RATE_LIMIT_MAX_WAIT_SECONDS"""
+
+def _bucket_key(model: str):
+    return f"ratelimit:{model}"
+
+def _pause_key(model: str):
+    return f"ratelimit:{model}:paused"
+
+# Take one request and ARGV[3] tokens from the buckets, or return how many
+# milliseconds to wait before they are available. A limit of 0 disables a
+# bucket; limits learnt from the API headers apply when they are lower.
+_ACQUIRE = redis_client.register_script("""
+local paused = redis.call('PTTL', KEYS[2])
+if paused > 0 then
+    return paused
+end
+
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+local state = redis.call('HMGET', KEYS[1], 'requests', 'tokens', 'ts', 'rpm_limit', 'tpm_limit')
+local rpm = tonumber(ARGV[1])
+local tpm = tonumber(ARGV[2])
+if state[4] and (rpm == 0 or tonumber(state[4]) < rpm) then rpm = tonumber(state[4]) end
+if state[5] and (tpm == 0 or tonumber(state[5]) < tpm) then tpm = tonumber(state[5]) end
+
+local elapsed = math.max(now - (tonumber(state[3]) or now), 0)
+local requests = tonumber(state[1]) or rpm
+local tokens = tonumber(state[2]) or tpm
+local wait = 0
+if rpm > 0 then
+    requests = math.min(rpm, requests + elapsed * rpm / 60000)
+    if requests < 1 then wait = math.max(wait, (1 - requests) * 60000 / rpm) end
+end
+if tpm > 0 then
+    -- A request larger than the whole bucket goes through once it is full
+    local cost = math.min(tonumber(ARGV[3]), tpm)
+    tokens = math.min(tpm, tokens + elapsed * tpm / 60000)
+    if tokens < cost then wait = math.max(wait, (cost - tokens) * 60000 / tpm) end
+    if wait == 0 then tokens = tokens - cost end
+end
+if wait == 0 then requests = requests - 1 end
+
+redis.call('HSET', KEYS[1], 'requests', requests, 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], 120000)
+return math.ceil(wait)
+""")
+
+# Bring the buckets down to the remaining requests and tokens the API
+# reported and remember its limits; empty arguments were not reported
+_SYNC = redis_client.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+if ARGV[1] ~= '' then redis.call('HSET', KEYS[1], 'rpm_limit', ARGV[1]) end
+if ARGV[3] ~= '' then redis.call('HSET', KEYS[1], 'tpm_limit', ARGV[3]) end
+local state = redis.call('HMGET', KEYS[1], 'requests', 'tokens')
+if ARGV[2] ~= '' and tonumber(state[1]) > tonumber(ARGV[2]) then
+    redis.call('HSET', KEYS[1], 'requests', ARGV[2])
+end
+if ARGV[4] ~= '' and tonumber(state[2]) > tonumber(ARGV[4]) then
+    redis.call('HSET', KEYS[1], 'tokens', ARGV[4])
+end
+return 1
+""")
+
+# Adjust the token bucket by ARGV[1], unless it expired meanwhile (the next
+# acquire starts it full)
+_SETTLE = redis_client.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('HINCRBYFLOAT', KEYS[1], 'tokens', ARGV[1])
+end
+return 0
+""")
+
+def acquire(model: str, requests_per_minute: int, tokens_per_minute: int, tokens: int = 0):
+    """
+    Block until the model has capacity for one request of the given number
+    of tokens, then take it. Sleeps are jittered so workers waiting on the
+    same bucket do not all retry at once.
+    """
+    deadline = time.monotonic() + OPENAI_RATE_LIMIT_MAX_WAIT_SECONDS
+    while True:
+        wait_ms = _ACQUIRE(
+            keys=[_bucket_key(model), _pause_key(model)],
+            args=[requests_per_minute, tokens_per_minute, tokens]
+        )
+        if wait_ms <= 0:
+            return
+        wait = wait_ms / 1000 * random.uniform(1, 1.25)
+        if time.monotonic() + wait > deadline:
+            raise RateLimitTimeout(model)
+        time.sleep(wait)
+
+def settle_tokens(model: str, reserved: int, used: int):
+    """Give back the reserved tokens a request did not use, or take the ones it used on top"""
+    if used is None or used == reserved:
+        return
+    _SETTLE(keys=[_bucket_key(model)], args=[reserved - used])
+
+def sync_with_headers(model: str, headers):
+    """Apply the x-ratelimit-* headers of an API response to the model's buckets"""
+    _SYNC(
+        keys=[_bucket_key(model)],
+        args=[
+            headers.get("x-ratelimit-limit-requests", ""),
+            headers.get("x-ratelimit-remaining-requests", ""),
+            headers.get("x-ratelimit-limit-tokens", ""),
+            headers.get("x-ratelimit-remaining-tokens", "")
+        ]
+    )
+
+def pause(model: str, seconds: float):
+    """Hold back every worker's requests for the model for the given time"""
+    redis_client.set(_pause_key(model), 1, px=max(int(seconds * 1000), 1))
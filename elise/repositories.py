@@ -0,0 +1,136 @@
+from datetime import datetime
+from bson import ObjectId
+from pymongo import ReturnDocument
+from .database import async_db
+from .resources import build_resource, next_resource_seq_update
+
+# Async data access for the routes. The Celery workers keep using the
+# blocking client from database.py directly.
+
+# Users
+
+async def find_user_by_email(email: str):
+    return await async_db.users.find_one({"email": email})
+
+async def insert_user(user: dict):
+    """Insert a user and return its ObjectId"""
+    result = await async_db.users.insert_one(user)
+    return result.inserted_id
+
+# Patients
+
+async def insert_patient(patient: dict):
+    """Insert a patient and return its ObjectId"""
+    result = await async_db.patients.insert_one(patient)
+    return result.inserted_id
+
+async def find_patient(patient_id: str, user_id: str):
+    """Return a patient owned by the user, or None"""
+    return await async_db.patients.find_one({
+        "_id": ObjectId(patient_id),
+        "user_id": user_id
+    })
+
+async def find_patients_by_user(user_id: str, projection: dict = None):
+    return await async_db.patients.find({"user_id": user_id}, projection).to_list()
+
+# Consultations
+
+async def insert_consultation(consultation: dict):
+    """Insert a consultation and return its ObjectId"""
+    result = await async_db.consultations.insert_one(consultation)
+    return result.inserted_id
+
+async def find_consultation(consultation_id: str, user_id: str, projection: dict = None):
+    """
+    Return a consultation owned by the user, or None. A legacy resources
+    array not migrated yet is never loaded.
+    """
+    return await async_db.consultations.find_one({
+        "consultation_id": consultation_id,
+        "user_id": user_id
+    }, projection or {"resources": 0})
+
+async def find_consultations_by_patient(patient_id: str, projection: dict = None):
+    return await async_db.consultations.find({"patient_id": patient_id}, projection).to_list()
+
+# Consultation resources
+
+async def insert_resource(consultation_id: str, kind: str, text: str, created_at: datetime = None, **fields):
+    """Append a resource to a consultation and return its seq"""
+    consultation = await async_db.consultations.find_one_and_update(
+        {"consultation_id": consultation_id},
+        next_resource_seq_update(),
+        projection={"resource_count": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    seq = consultation["resource_count"]
+    await async_db.consultation_resources.insert_one(
+        build_resource(consultation_id, seq, kind, text, created_at, **fields)
+    )
+    return seq
+
+async def find_resources_page(consultation_id: str, after_seq: int = 0, kinds: list = None, limit: int = 50):
+    """Return up to limit resources of a consultation after the given seq, oldest first"""
+    query = {"consultation_id": consultation_id, "seq": {"$gt": after_seq}}
+    if kinds:
+        query["kind"] = {"$in": kinds}
+    return await async_db.consultation_resources.find(query, {"_id": 0}).sort("seq", 1).limit(limit).to_list()
+
+# Temp files
+
+async def save_temp_file(temp_file: dict):
+    """Insert or replace the metadata of an uploaded audio file"""
+    await async_db.temp_files.replace_one({"file_id": temp_file["file_id"]}, temp_file, upsert=True)
+
+# Upload sessions
+
+async def insert_upload_session(session: dict):
+    await async_db.upload_sessions.insert_one(session)
+
+async def find_upload_session(upload_id: str, user_id: str):
+    """Return a resumable upload session owned by the user, or None"""
+    return await async_db.upload_sessions.find_one({"upload_id": upload_id, "user_id": user_id})
+
+async def advance_upload_session(upload_id: str, offset: int, length: int):
+    """
+    Move the committed offset of an open upload forward past a stored part.
+    Returns False when the offset moved meanwhile (another request committed
+    that range first).
+    """
+    result = await async_db.upload_sessions.update_one(
+        {"upload_id": upload_id, "offset": offset, "status": "open"},
+        {"$set": {"offset": offset + length, "updated_at": datetime.utcnow()}}
+    )
+    return result.modified_count == 1
+
+async def claim_upload_session(upload_id: str, stale_time: datetime):
+    """
+    Move an open upload session to finalizing, or take over a finalization
+    that has been stuck since before stale_time. Returns None when another
+    request holds it.
+    """
+    return await async_db.upload_sessions.find_one_and_update(
+        {
+            "upload_id": upload_id,
+            "$or": [
+                {"status": "open"},
+                {"status": "finalizing", "updated_at": {"$lt": stale_time}}
+            ]
+        },
+        {"$set": {"status": "finalizing", "updated_at": datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER
+    )
+
+async def set_upload_session_status(upload_id: str, status: str, **fields):
+    await async_db.upload_sessions.update_one(
+        {"upload_id": upload_id},
+        {"$set": {"status": status, "updated_at": datetime.utcnow(), **fields}}
+    )
+
+# Memberships
+
+async def insert_membership(membership: dict):
+    """Insert a membership and return its ObjectId"""
+    result = await async_db.memberships.insert_one(membership)
+    return result.inserted_id
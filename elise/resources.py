@@ -0,0 +1,56 @@
+from datetime import datetime
+from pymongo import ReturnDocument
+from .context import count_tokens
+from .database import db
+
+# Transcripts, Q&A and reports of a consultation are stored one document
+# each in consultation_resources instead of an array inside the
+# consultation. Every resource gets the next value of the consultation's
+# resource_count as its seq, which orders them and serves as the
+# pagination cursor and the report watermark.
+
+RESOURCE_KINDS = ("transcript", "question", "report")
+
+def next_resource_seq_update():
+    """
+    Pipeline update that bumps resource_count. A consultation that still
+    has its legacy resources array continues numbering after it, so the
+    migration can give those resources seq 1..n.
+    """
+    return [{"$set": {"resource_count": {"$add": [
+        {"$ifNull": ["$resource_count", {"$size": {"$ifNull": ["$resources", []]}}]},
+        1
+    ]}}}]
+
+def build_resource(consultation_id: str, seq: int, kind: str, text: str, created_at: datetime = None, **fields):
+    """Return a consultation_resources document"""
+    return {
+        "consultation_id": consultation_id,
+        "seq": seq,
+        "kind": kind,
+        "created_at": created_at or datetime.utcnow(),
+        "text": text,
+        "token_count": count_tokens(text + fields.get("question", "")),
+        **fields
+    }
+
+def add_resource(consultation_id: str, kind: str, text: str, created_at: datetime = None, **fields):
+    """Append a resource to a consultation and return its seq"""
+    consultation = db.consultations.find_one_and_update(
+        {"consultation_id": consultation_id},
+        next_resource_seq_update(),
+        projection={"resource_count": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not consultation:
+        raise Exception(f"Consultation with ID {consultation_id} not found")
+    seq = consultation["resource_count"]
+    db.consultation_resources.insert_one(build_resource(consultation_id, seq, kind, text, created_at, **fields))
+    return seq
+
+def find_resources(consultation_id: str, after_seq: int = 0, kinds: list = None):
+    """Return the resources of a consultation after the given seq, oldest first"""
+    query = {"consultation_id": consultation_id, "seq": {"$gt": after_seq}}
+    if kinds:
+        query["kind"] = {"$in": kinds}
+    return list(db.consultation_resources.find(query, {"_id": 0}).sort("seq", 1))
@@ -1,15 +1,41 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, WebSocket, Request, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
 from ..openai_helper import transcribe_audio, complete_chat
-from ..task import transcribe_audio_task, complete_chat_task, create_report_task
-from ..database import db
+from ..task import (
+    transcribe_audio_task,
+    transcribe_segment_task,
+    complete_chat_task,
+    create_report_task,
+    INTERACTIVE_PRIORITY,
+    CHAT_QUEUE,
+    REPORTS_QUEUE,
+    TRANSCRIPTION_QUEUE,
+    MAINTENANCE_QUEUE
+)
+from .. import repositories
+from ..task_registry import record_task, find_tasks, set_task_state
+from ..events import register_task, get_task_owner, publish_task_event, listen_stream, listen_task_events
+from ..tickets import issue_ticket, redeem_ticket
+from ..single_flight import flight_key, join_flight, leave_flight
+from ..answer_cache import normalize_prompt, answer_cache_stats
+from ..admission import Overloaded, admit, check_capacity, release_admission, release_user_task, queue_stats
+from ..quota import QuotaExceeded, NoMembership, charge_quota, refund_quota, refund_quota_async, settle_quota
+from ..storage import save_upload, save_blob, save_part, UploadGap, UploadPartsReader, delete_parts, delete_blob
+from ..config import AUDIO_CHUNK_SIZE, STREAM_MAX_WINDOW_BYTES, STREAM_WINDOW_TIMEOUT_SECONDS, STREAM_TICKET_TTL_SECONDS
+from ..audio import merge_transcripts
 from ..utils.auth import decode_access_token
 from bson import ObjectId
+from typing import List, Literal, Optional
+import asyncio
+import io
+import json
 import os
 import tempfile
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 
 router = APIRouter(prefix="/api/ai", tags=["AI"])
 security = HTTPBearer()
@@ -20,13 +46,94 @@ async def get_current_user(credentials = Depends(security)):
         email: str = payload.get("sub")
         if email is None:
             raise HTTPException(status_code=401, detail="Invalid authentication token")
-        user = db.users.find_one({"email": email})
+        user = await repositories.find_user_by_email(email)
         if not user:
             raise HTTPException(status_code=401, detail="User not found")
         return str(user["_id"])
     except Exception:
         raise HTTPException(status_code=401, detail="Invalid authentication token")
 
+@router.post("/tickets")
+async def create_ticket(
+    scope: Literal["events", "stream", "transcribe"] = Form(...),
+    target: Optional[str] = Form(None),
+    current_user_id: str = Depends(get_current_user)
+):
+    """
+    Issue a short-lived, single-use ticket for /events (scope=events),
+    /stream/{target} (scope=stream) or the live transcription WebSocket of
+    consultation target (scope=transcribe). EventSource and WebSocket cannot
+    send the Authorization header, and the ticket keeps the access token out
+    of URLs and access logs.
+    """
+    if scope == "events":
+        full_scope = "events"
+    elif not target:
+        raise HTTPException(status_code=400, detail="target is required for this scope")
+    elif scope == "stream":
+        if await get_task_owner(target) != current_user_id:
+            raise HTTPException(status_code=404, detail="Stream not found or not authorized")
+        full_scope = f"stream:{target}"
+    else:
+        if not await repositories.find_consultation(target, current_user_id):
+            raise HTTPException(status_code=404, detail="Consultation not found or not authorized")
+        full_scope = f"transcribe:{target}"
+    
+    ticket = await issue_ticket(current_user_id, full_scope)
+    return JSONResponse({"ticket": ticket, "expires_in": STREAM_TICKET_TTL_SECONDS})
+
+async def track_task(task_id: str, user_id: str, consultation_id: str, kind: str):
+    """
+    Record a task in the tasks collection and on the task-event bus before it is enqueued
+    """
+    await run_in_threadpool(record_task, task_id, user_id, consultation_id, kind)
+    await run_in_threadpool(register_task, task_id, user_id, consultation_id, kind)
+
+async def check_admission(queue: str, user_id: str):
+    """
+    Answer 429 up front when a new task of the user would not be admitted
+    to the queue, so large uploads are refused before they are stored
+    """
+    try:
+        await check_capacity(queue, user_id)
+    except Overloaded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+async def admit_task(queue: str, user_id: str, task_id: str, flight: str = None):
+    """
+    Admit a task holding the single-flight claim flight (if any) to its
+    queue and charge it to the user's quota. Otherwise give the claim up and
+    answer 429 when the queue or the user is at capacity, 402 when the quota
+    is used up and 403 when the user has no membership.
+    """
+    try:
+        await admit(queue, user_id, task_id)
+    except Overloaded as e:
+        if flight:
+            await leave_flight(flight, task_id)
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    try:
+        await charge_quota(user_id, task_id)
+    except (QuotaExceeded, NoMembership) as e:
+        if flight:
+            await leave_flight(flight, task_id)
+        await release_admission(task_id)
+        raise HTTPException(status_code=403 if isinstance(e, NoMembership) else 402, detail=str(e))
+
+async def enqueue_task(task, args: tuple, kwargs: dict, task_id: str, user_id: str, consultation_id: str, kind: str, flight: str):
+    """
+    Track and enqueue an admitted task holding the single-flight claim
+    flight, giving the claim, the admission and the quota back if that fails
+    """
+    try:
+        await track_task(task_id, user_id, consultation_id, kind)
+        task.apply_async(args, kwargs, task_id=task_id)
+    except Exception:
+        await leave_flight(flight, task_id)
+        await release_admission(task_id)
+        await refund_quota_async(task_id)
+        raise
+
 @router.post("/transcribe")
 async def transcribe_audio_endpoint(
     file: UploadFile = File(...),
@@ -37,10 +144,7 @@ async def transcribe_audio_endpoint(
     Upload an audio file and get its transcription
     """
     # Validate that the consultation exists and belongs to the current user
-    consultation = db.consultations.find_one({
-        "consultation_id": consultation_id,
-        "user_id": current_user_id
-    })
+    consultation = await repositories.find_consultation(consultation_id, current_user_id)
     
     if not consultation:
         raise HTTPException(status_code=404, detail="Consultation not found or not authorized")
@@ -49,40 +153,276 @@ async def transcribe_audio_endpoint(
     print(f"File: {file}")
     print("File is an audio file")
     
+    # Refuse before storing the upload; the slot is reserved once it is
+    await check_admission(TRANSCRIPTION_QUEUE, current_user_id)
+    
     try:
-        # Read the file content
-        content = await file.read()
-        
         # Generate a unique file ID
         file_id = str(uuid.uuid4())
+        filename = file.filename or "audio.webm"
+        content_type = file.content_type or "audio/webm"
+        
+        # Stream the upload into GridFS in fixed-size chunks
+        blob = await save_upload(file, filename, content_type, metadata={"file_id": file_id})
         
-        # Store the file in MongoDB temp_files collection
+        # The same recording uploaded again while it is being transcribed
+        # follows the running task
+        task_id = str(uuid.uuid4())
+        flight = flight_key("transcription", consultation_id, blob["sha256"])
+        running_task_id = await join_flight(flight, task_id)
+        if running_task_id:
+            await run_in_threadpool(delete_blob, blob["blob_id"])
+            return JSONResponse({
+                "message": "Audio transcription already in progress",
+                "task_id": running_task_id,
+                "status": "processing",
+                "consultation_id": consultation_id,
+                "deduplicated": True
+            })
+        try:
+            await admit_task(TRANSCRIPTION_QUEUE, current_user_id, task_id, flight)
+        except HTTPException:
+            await run_in_threadpool(delete_blob, blob["blob_id"])
+            raise
+        
+        # Store the file metadata in MongoDB temp_files collection
         temp_file_doc = {
             "file_id": file_id,
             "consultation_id": consultation_id,
             "user_id": current_user_id,
-            "filename": file.filename or "audio.webm",
-            "content_type": file.content_type or "audio/webm",
-            "file_data": content,
+            "filename": filename,
+            "content_type": content_type,
+            "blob_id": blob["blob_id"],
+            "length": blob["length"],
+            "sha256": blob["sha256"],
             "created_at": datetime.utcnow()
         }
         
-        db.temp_files.insert_one(temp_file_doc)
+        await repositories.save_temp_file(temp_file_doc)
         
         # Process the transcription asynchronously using Celery
-        task = transcribe_audio_task.delay(file_id, consultation_id)
+        await enqueue_task(
+            transcribe_audio_task, (file_id, consultation_id), {},
+            task_id, current_user_id, consultation_id, "transcription", flight
+        )
         
         return JSONResponse({
             "message": "Audio transcription started",
-            "task_id": task.id,
+            "task_id": task_id,
             "status": "processing",
             "consultation_id": consultation_id,
             "file_id": file_id
         })
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing audio: {str(e)}")
 
+async def get_upload_session(upload_id: str, user_id: str):
+    """Return a resumable upload session owned by the user, or raise 404"""
+    session = await repositories.find_upload_session(upload_id, user_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload not found or not authorized")
+    return session
+
+def upload_session_status(session: dict):
+    return {
+        "upload_id": session["upload_id"],
+        "offset": session["offset"],
+        "total_size": session.get("total_size"),
+        "status": session["status"],
+        "task_id": session["task_id"] if session["status"] == "finalized" else None
+    }
+
+@router.post("/uploads")
+async def create_upload_endpoint(
+    consultation_id: str = Form(...),
+    filename: str = Form("audio.webm"),
+    content_type: str = Form("audio/webm"),
+    total_size: Optional[int] = Form(None),
+    current_user_id: str = Depends(get_current_user)
+):
+    """
+    Start a resumable audio upload. Send the bytes with PUT /uploads/{upload_id}
+    and start the transcription with POST /uploads/{upload_id}/finalize.
+    """
+    # Validate that the consultation exists and belongs to the current user
+    consultation = await repositories.find_consultation(consultation_id, current_user_id)
+    
+    if not consultation:
+        raise HTTPException(status_code=404, detail="Consultation not found or not authorized")
+    
+    # No point in uploading a recording that could not be transcribed now;
+    # the slot is reserved when the upload is finalized
+    await check_admission(TRANSCRIPTION_QUEUE, current_user_id)
+    
+    # The file and task IDs are chosen up front so finalizing is idempotent
+    session = {
+        "upload_id": str(uuid.uuid4()),
+        "file_id": str(uuid.uuid4()),
+        "task_id": str(uuid.uuid4()),
+        "consultation_id": consultation_id,
+        "user_id": current_user_id,
+        "filename": filename,
+        "content_type": content_type,
+        "total_size": total_size,
+        "offset": 0,
+        "status": "open",
+        "created_at": datetime.utcnow(),
+        "updated_at": datetime.utcnow()
+    }
+    await repositories.insert_upload_session(session)
+    
+    return JSONResponse(upload_session_status(session))
+
+@router.get("/uploads/{upload_id}")
+async def get_upload_endpoint(
+    upload_id: str,
+    current_user_id: str = Depends(get_current_user)
+):
+    """
+    Get the committed offset of a resumable upload, to know where to resume
+    """
+    return JSONResponse(upload_session_status(await get_upload_session(upload_id, current_user_id)))
+
+@router.put("/uploads/{upload_id}")
+async def put_upload_range_endpoint(
+    upload_id: str,
+    offset: int,
+    request: Request,
+    current_user_id: str = Depends(get_current_user)
+):
+    """
+    Append the request body to a resumable upload starting at the given byte offset.
+    Bytes before the committed offset are skipped, so a retried range is harmless.
+    When another request commits the same range first (a client retrying while
+    this one is still being read), this one stops with 409 and the real offset.
+    """
+    session = await get_upload_session(upload_id, current_user_id)
+    if session["status"] != "open":
+        raise HTTPException(status_code=409, detail="Upload is already finalized")
+    
+    committed = session["offset"]
+    if offset > committed:
+        raise HTTPException(status_code=409, detail=f"Upload is committed up to offset {committed}")
+    
+    skip = committed - offset
+    buffer = bytearray()
+    
+    async def commit(data: bytes):
+        nonlocal committed
+        await run_in_threadpool(save_part, upload_id, committed, data)
+        if not await repositories.advance_upload_session(upload_id, committed, len(data)):
+            current = await get_upload_session(upload_id, current_user_id)
+            raise HTTPException(status_code=409, detail=f"Upload is committed up to offset {current['offset']}")
+        committed += len(data)
+    
+    try:
+        async for chunk in request.stream():
+            if skip:
+                dropped = min(skip, len(chunk))
+                chunk = chunk[dropped:]
+                skip -= dropped
+            buffer.extend(chunk)
+            # Persist every full part as soon as it arrives
+            while len(buffer) >= AUDIO_CHUNK_SIZE:
+                await commit(bytes(buffer[:AUDIO_CHUNK_SIZE]))
+                del buffer[:AUDIO_CHUNK_SIZE]
+    except ClientDisconnect:
+        print(f"Upload {upload_id} interrupted at offset {committed + len(buffer)}")
+    
+    if buffer:
+        await commit(bytes(buffer))
+    
+    return JSONResponse({"upload_id": upload_id, "offset": committed})
+
+@router.post("/uploads/{upload_id}/finalize")
+async def finalize_upload_endpoint(
+    upload_id: str,
+    current_user_id: str = Depends(get_current_user)
+):
+    """
+    Assemble a resumable upload and start its transcription exactly once
+    """
+    session = await get_upload_session(upload_id, current_user_id)
+    
+    if session["status"] != "finalized":
+        if session.get("total_size") is not None and session["offset"] != session["total_size"]:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Upload is incomplete: {session['offset']} of {session['total_size']} bytes"
+            )
+        
+        # Only one request can move the session out of the open state. A
+        # finalization interrupted by an API restart is taken over once stale.
+        stale_time = datetime.utcnow() - timedelta(minutes=5)
+        session = await repositories.claim_upload_session(upload_id, stale_time)
+        if session:
+            # GridFS and the upload parts are shared with the workers and stay blocking
+            try:
+                blob = await run_in_threadpool(
+                    save_blob,
+                    UploadPartsReader(upload_id, session["offset"]),
+                    session["filename"],
+                    metadata={"file_id": session["file_id"], "content_type": session["content_type"]}
+                )
+            except UploadGap as e:
+                # Go back to the last contiguous byte so the client resends the rest
+                await run_in_threadpool(delete_parts, upload_id, e.offset)
+                await repositories.set_upload_session_status(upload_id, "open", offset=e.offset)
+                raise HTTPException(status_code=409, detail=f"Upload is committed up to offset {e.offset}")
+            flight = flight_key("transcription", session["consultation_id"], blob["sha256"])
+            running_task_id = await join_flight(flight, session["task_id"])
+            if running_task_id:
+                # The same recording is already being transcribed, follow that task
+                await run_in_threadpool(delete_blob, blob["blob_id"])
+                await repositories.set_upload_session_status(upload_id, "finalized", task_id=running_task_id)
+                await run_in_threadpool(delete_parts, upload_id)
+                return JSONResponse({
+                    "message": "Audio transcription already in progress",
+                    "task_id": running_task_id,
+                    "status": "processing",
+                    "consultation_id": session["consultation_id"],
+                    "deduplicated": True
+                })
+            try:
+                await admit_task(TRANSCRIPTION_QUEUE, current_user_id, session["task_id"], flight)
+            except HTTPException:
+                # The parts are kept, so finalizing can be retried later
+                await run_in_threadpool(delete_blob, blob["blob_id"])
+                await repositories.set_upload_session_status(upload_id, "open")
+                raise
+            await repositories.save_temp_file({
+                "file_id": session["file_id"],
+                "consultation_id": session["consultation_id"],
+                "user_id": current_user_id,
+                "filename": session["filename"],
+                "content_type": session["content_type"],
+                "blob_id": blob["blob_id"],
+                "length": blob["length"],
+                "sha256": blob["sha256"],
+                "created_at": datetime.utcnow()
+            })
+            await enqueue_task(
+                transcribe_audio_task, (session["file_id"], session["consultation_id"]), {},
+                session["task_id"], current_user_id, session["consultation_id"], "transcription", flight
+            )
+            await repositories.set_upload_session_status(upload_id, "finalized")
+            await run_in_threadpool(delete_parts, upload_id)
+        session = await get_upload_session(upload_id, current_user_id)
+    
+    if session["status"] != "finalized":
+        raise HTTPException(status_code=409, detail="Upload is being finalized")
+    
+    return JSONResponse({
+        "message": "Audio transcription started",
+        "task_id": session["task_id"],
+        "status": "processing",
+        "consultation_id": session["consultation_id"],
+        "file_id": session["file_id"]
+    })
+
 @router.get("/transcribe/{task_id}")
 async def get_transcription_status(
     task_id: str,
@@ -95,9 +435,10 @@ async def get_transcription_status(
     task = transcribe_audio_task.AsyncResult(task_id)
     print(f"Task: {task}")
 
-    if task.ready():
+    # The result backend is blocking, keep it off the event loop
+    if await run_in_threadpool(task.ready):
         if task.successful():
-            result = task.get()
+            result = await run_in_threadpool(task.get)
             return JSONResponse({
                 "task_id": task_id,
                 "status": "completed",
@@ -116,20 +457,191 @@ async def get_transcription_status(
             "status": "processing"
         })
 
+def finish_live_session(session_id: str, saved: bool):
+    """
+    Settle a live transcription session the way the workers settle a task:
+    it keeps its charge only if a transcript was saved
+    """
+    if saved:
+        set_task_state(session_id, "done")
+        publish_task_event(session_id, "done")
+        settle_quota(session_id)
+    else:
+        set_task_state(session_id, "failed", error="Nothing was transcribed")
+        publish_task_event(session_id, "failed", error="Nothing was transcribed")
+        refund_quota(session_id)
+    release_user_task(session_id)
+
+@router.websocket("/transcribe/stream")
+async def transcribe_stream_endpoint(
+    websocket: WebSocket,
+    consultation_id: str,
+    ticket: str
+):
+    """
+    Transcribe a consultation live while it is being recorded.
+
+    The client sends the audio of the current window as binary messages and
+    {"event": "window"} once that window is complete; {"event": "stop"} closes
+    the last window. Consecutive windows overlap by about a second. Each
+    window is queued for transcription as soon as it arrives and its text is
+    pushed back as {"event": "partial"}, with the windows so far stitched
+    together as its transcript. When every window is done the transcript is
+    saved and sent as {"event": "final"}.
+    """
+    current_user_id = await redeem_ticket(ticket, f"transcribe:{consultation_id}")
+    consultation = None
+    if current_user_id:
+        # Validate that the consultation exists and belongs to the current user
+        consultation = await repositories.find_consultation(consultation_id, current_user_id)
+    
+    if not consultation:
+        await websocket.close(code=1008)
+        return
+    
+    await websocket.accept()
+    
+    # The session is admitted and charged once, like an uploaded recording;
+    # its segment workers also publish the text of every window on its id
+    session_id = str(uuid.uuid4())
+    try:
+        await admit_task(TRANSCRIPTION_QUEUE, current_user_id, session_id)
+    except HTTPException as e:
+        await websocket.send_json({"event": "error", "detail": e.detail})
+        await websocket.close(code=1013 if e.status_code == 429 else 1008)
+        return
+    
+    saved = False
+    try:
+        await track_task(session_id, current_user_id, consultation_id, "transcription")
+        
+        started_at = datetime.utcnow()
+        window = bytearray()
+        window_start = 0.0
+        window_count = 0
+        pending = set()
+        texts = {}
+        windows_done = asyncio.Event()
+        windows_done.set()
+        connected = True
+        
+        async def send(message: dict):
+            nonlocal connected
+            if not connected:
+                return
+            try:
+                await websocket.send_json(message)
+            except Exception:
+                connected = False
+        
+        async def queue_window():
+            nonlocal window, window_start, window_count
+            if not window:
+                return
+            index = window_count
+            window_count += 1
+            window_end = (datetime.utcnow() - started_at).total_seconds()
+            
+            # Hand the window to a segment worker through GridFS
+            blob = await run_in_threadpool(
+                save_blob,
+                io.BytesIO(bytes(window)),
+                f"stream_{consultation_id}_{index}.webm",
+                metadata={"consultation_id": consultation_id}
+            )
+            # Live windows are waited on, so they go before queued recordings
+            task = transcribe_segment_task.apply_async(
+                (str(blob["blob_id"]), index, window_start, window_end, ".webm"),
+                {"stream_id": session_id},
+                priority=INTERACTIVE_PRIORITY
+            )
+            pending.add(index)
+            windows_done.clear()
+            window = bytearray()
+            window_start = window_end
+            await send({"event": "queued", "index": index, "task_id": task.id})
+        
+        def stitched_transcript():
+            # The overlap between windows is kept once
+            return merge_transcripts([texts[index] for index in sorted(texts) if texts[index]])
+        
+        async def watch_results():
+            async for message in listen_stream(session_id):
+                if message is None or message.get("index") not in pending:
+                    continue
+                index = message["index"]
+                pending.discard(index)
+                if message["event"] == "segment":
+                    texts[index] = message["text"]
+                    await send({"event": "partial", "index": index, "text": message["text"], "transcript": stitched_transcript()})
+                else:
+                    texts[index] = ""
+                    await send({"event": "error", "index": index, "detail": message["detail"]})
+                if not pending:
+                    windows_done.set()
+        
+        watcher = asyncio.create_task(watch_results())
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    connected = False
+                    break
+                
+                if message.get("bytes"):
+                    window.extend(message["bytes"])
+                    if len(window) > STREAM_MAX_WINDOW_BYTES:
+                        await send({"event": "error", "detail": "Audio window too large"})
+                        break
+                elif message.get("text"):
+                    event = json.loads(message["text"]).get("event")
+                    if event == "window":
+                        await queue_window()
+                    elif event == "stop":
+                        await queue_window()
+                        break
+            
+            # Wait for the windows still being transcribed, but not forever:
+            # a result that never arrives (workers down, a lost publish)
+            # would hold the session's admission slot and charge
+            if pending:
+                stats = await queue_stats(TRANSCRIPTION_QUEUE)
+                timeout = stats["estimated_wait_seconds"] + STREAM_WINDOW_TIMEOUT_SECONDS * len(pending)
+                try:
+                    await asyncio.wait_for(windows_done.wait(), timeout)
+                except asyncio.TimeoutError:
+                    for index in sorted(pending):
+                        texts[index] = ""
+                        await send({"event": "error", "index": index, "detail": "Window was not transcribed in time"})
+                    pending.clear()
+        finally:
+            watcher.cancel()
+        
+        transcription = stitched_transcript()
+        if transcription:
+            # Add the transcription to the consultation's resources
+            await repositories.insert_resource(consultation_id, "transcript", transcription, created_at=started_at)
+            saved = True
+        
+        await send({"event": "final", "transcription": transcription})
+        if connected:
+            await websocket.close()
+    finally:
+        await run_in_threadpool(finish_live_session, session_id, saved)
+
 @router.post("/chat")
 async def complete_chat_endpoint(
     prompt: str = Form(...),
     consultation_id: str = Form(...),
+    stream: bool = Form(False),
     current_user_id: str = Depends(get_current_user)
 ):
     """
-    Send a prompt and get a chat completion
+    Send a prompt and get a chat completion.
+    With stream=true the answer can be followed token by token on /stream/{task_id}.
     """
     # Validate that the consultation exists and belongs to the current user
-    consultation = db.consultations.find_one({
-        "consultation_id": consultation_id,
-        "user_id": current_user_id
-    })
+    consultation = await repositories.find_consultation(consultation_id, current_user_id)
     
     if not consultation:
         raise HTTPException(status_code=404, detail="Consultation not found or not authorized")
@@ -137,15 +649,32 @@ async def complete_chat_endpoint(
     try:
         # Process the chat completion asynchronously using Celery
         print(f"Processing chat completion for prompt: {prompt}")
-        task = complete_chat_task.delay(prompt, consultation_id)
-        print(f"Chat completion task started: {task.id}")
+        task_id = str(uuid.uuid4())
+        # The same question asked again before it is answered gets that answer
+        flight = flight_key("chat", consultation_id, normalize_prompt(prompt), stream, consultation.get("resource_count", 0))
+        running_task_id = await join_flight(flight, task_id)
+        if running_task_id:
+            return JSONResponse({
+                "message": "Chat completion already in progress",
+                "task_id": running_task_id,
+                "status": "processing",
+                "deduplicated": True
+            })
+        await admit_task(CHAT_QUEUE, current_user_id, task_id, flight)
+        await enqueue_task(
+            complete_chat_task, (prompt, consultation_id), {"stream": stream},
+            task_id, current_user_id, consultation_id, "chat", flight
+        )
+        print(f"Chat completion task started: {task_id}")
         
         return JSONResponse({
             "message": "Chat completion started",
-            "task_id": task.id,
+            "task_id": task_id,
             "status": "processing"
         })
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing chat completion: {str(e)}")
 
@@ -159,9 +688,10 @@ async def get_chat_completion_status(
     """
     task = complete_chat_task.AsyncResult(task_id)
     
-    if task.ready():
+    # The result backend is blocking, keep it off the event loop
+    if await run_in_threadpool(task.ready):
         if task.successful():
-            result = task.get()
+            result = await run_in_threadpool(task.get)
             return JSONResponse({
                 "task_id": task_id,
                 "status": "completed",
@@ -179,41 +709,146 @@ async def get_chat_completion_status(
             "status": "processing"
         })
 
+@router.get("/tasks")
+async def get_tasks_status(
+    task_id: Optional[List[str]] = Query(None),
+    consultation_id: Optional[str] = None,
+    active: bool = False,
+    current_user_id: str = Depends(get_current_user)
+):
+    """
+    Get the status of many tasks in one request: the given task_id values,
+    every task of a consultation, or with active=true only the unfinished ones
+    """
+    if not task_id and not consultation_id:
+        raise HTTPException(status_code=400, detail="Provide task_id or consultation_id")
+    
+    tasks = await run_in_threadpool(find_tasks, current_user_id, task_id, consultation_id, active)
+    return JSONResponse({"tasks": tasks})
+
+@router.get("/metrics")
+async def get_queue_metrics(current_user_id: str = Depends(get_current_user)):
+    """
+    Depth, running tasks, average task time and estimated wait of every
+    task queue, with the answer cache counters
+    """
+    queues = {}
+    for queue in (CHAT_QUEUE, REPORTS_QUEUE, TRANSCRIPTION_QUEUE, MAINTENANCE_QUEUE):
+        queues[queue] = await queue_stats(queue)
+    return JSONResponse({
+        "queues": queues,
+        "answer_cache": await run_in_threadpool(answer_cache_stats)
+    })
+
+@router.get("/events")
+async def task_events(ticket: str):
+    """
+    Server-Sent Events with the state changes (queued, started, progress,
+    done, failed) of every task of the user, replacing per-task polling.
+    The last known state of recent tasks is sent first.
+    Authenticated with a ticket of scope events from POST /tickets.
+    """
+    current_user_id = await redeem_ticket(ticket, "events")
+    if not current_user_id:
+        raise HTTPException(status_code=401, detail="Invalid or expired ticket")
+    
+    async def events():
+        async for message in listen_task_events(current_user_id):
+            if message is None:
+                # Comment line so proxies keep the connection open
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: task\ndata: {json.dumps(message)}\n\n"
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/stream/{task_id}")
+async def stream_task_tokens(task_id: str, ticket: str):
+    """
+    Server-Sent Events with the tokens of a streamed chat or report task.
+    Authenticated with a ticket of scope stream from POST /tickets, because
+    EventSource cannot send headers.
+    """
+    current_user_id = await redeem_ticket(ticket, f"stream:{task_id}")
+    if not current_user_id:
+        raise HTTPException(status_code=401, detail="Invalid or expired ticket")
+    if await get_task_owner(task_id) != current_user_id:
+        raise HTTPException(status_code=404, detail="Stream not found or not authorized")
+    
+    async def events():
+        async for message in listen_stream(task_id):
+            if message is None:
+                # Comment line so proxies keep the connection open
+                yield ": keepalive\n\n"
+                continue
+            event = message.pop("event")
+            yield f"event: {event}\ndata: {json.dumps(message)}\n\n"
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post("/create_reporte")
 async def create_reporte_endpoint(
     consultation_id: str = Form(...),
+    mode: Literal["incremental", "full"] = Form("incremental"),
+    stream: bool = Form(False),
     current_user_id: str = Depends(get_current_user)
 ):
     """
-    Create a summary report from all resources in a consultation
+    Create a summary report from the resources in a consultation.
+    By default only resources added since the last report are merged in;
+    mode=full regenerates the report from every resource.
+    With stream=true the report can be followed token by token on /stream/{task_id}.
     """
     # Validate that the consultation exists and belongs to the current user
-    consultation = db.consultations.find_one({
-        "consultation_id": consultation_id,
-        "user_id": current_user_id
-    })
+    consultation = await repositories.find_consultation(consultation_id, current_user_id)
     
     if not consultation:
         raise HTTPException(status_code=404, detail="Consultation not found or not authorized")
     
     # Check if there are resources to create a report from
-    resources = consultation.get("resources", [])
-    if not resources:
+    if not consultation.get("resource_count"):
         raise HTTPException(status_code=400, detail="No resources found for this consultation. Add transcriptions or chat conversations first.")
     
     try:
         # Process the report creation asynchronously using Celery
         print(f"Creating report for consultation: {consultation_id}")
-        task = create_report_task.delay(consultation_id)
-        print(f"Report creation task started: {task.id}")
+        task_id = str(uuid.uuid4())
+        # Repeated clicks while a report of the same resources is being
+        # written follow that report
+        flight = flight_key("report", consultation_id, mode, stream, consultation["resource_count"])
+        running_task_id = await join_flight(flight, task_id)
+        if running_task_id:
+            return JSONResponse({
+                "message": "Report creation already in progress",
+                "task_id": running_task_id,
+                "status": "processing",
+                "consultation_id": consultation_id,
+                "deduplicated": True
+            })
+        await admit_task(REPORTS_QUEUE, current_user_id, task_id, flight)
+        await enqueue_task(
+            create_report_task, (consultation_id, mode), {"stream": stream},
+            task_id, current_user_id, consultation_id, "report", flight
+        )
+        print(f"Report creation task started: {task_id}")
         
         return JSONResponse({
             "message": "Report creation started",
-            "task_id": task.id,
+            "task_id": task_id,
             "status": "processing",
             "consultation_id": consultation_id
         })
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating report: {str(e)}")
 
@@ -227,9 +862,10 @@ async def get_report_creation_status(
     """
     task = create_report_task.AsyncResult(task_id)
     
-    if task.ready():
+    # The result backend is blocking, keep it off the event loop
+    if await run_in_threadpool(task.ready):
         if task.successful():
-            result = task.get()
+            result = await run_in_threadpool(task.get)
             return JSONResponse({
                 "task_id": task_id,
                 "status": "completed",
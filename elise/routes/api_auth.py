@@ -2,14 +2,14 @@ from fastapi import APIRouter, HTTPException, Depends, Form
 from fastapi.security import OAuth2PasswordRequestForm
 from elise.utils.auth import verify_password, create_access_token
 from elise.models import Token
-from elise.database import db
+from elise import repositories
 from datetime import timedelta
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 @router.post("/token", response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = db.users.find_one({"email": form_data.username})
+    user = await repositories.find_user_by_email(form_data.username)
     if not user or not verify_password(form_data.password, user["password"]):
         raise HTTPException(status_code=401, detail="Incorrect username or password")
     
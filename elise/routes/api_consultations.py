@@ -1,10 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from elise.models import Consultation, ConsultationCreate
-from elise.database import db
+from elise import repositories
 from elise.utils.auth import decode_access_token
 from fastapi.security import HTTPBearer
 from datetime import datetime
-from typing import List
+from typing import List, Literal, Optional
 from bson import ObjectId
 import json
 
@@ -17,7 +17,7 @@ async def get_current_user(credentials = Depends(security)):
         email: str = payload.get("sub")
         if email is None:
             raise HTTPException(status_code=401, detail="Invalid authentication token")
-        user = db.users.find_one({"email": email})
+        user = await repositories.find_user_by_email(email)
         if not user:
             raise HTTPException(status_code=401, detail="User not found")
         return str(user["_id"])
@@ -48,10 +48,7 @@ async def create_consultation(
     current_user_id: str = Depends(get_current_user)
 ):
     # Verify that the patient belongs to the current user
-    patient = db.patients.find_one({
-        "_id": ObjectId(consultation.patient_id),
-        "user_id": current_user_id
-    })
+    patient = await repositories.find_patient(consultation.patient_id, current_user_id)
     
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found or not authorized")
@@ -59,12 +56,11 @@ async def create_consultation(
     consultation_dict = consultation.dict()
     consultation_dict["consultation_id"] = str(ObjectId())
     consultation_dict["user_id"] = current_user_id
-    # Ensure resources list is initialized
-    if "resources" not in consultation_dict:
-        consultation_dict["resources"] = []
+    # Resources live in consultation_resources, numbered from 1
+    consultation_dict["resource_count"] = 0
     
-    result = db.consultations.insert_one(consultation_dict)
-    consultation_dict["_id"] = str(result.inserted_id)
+    consultation_object_id = await repositories.insert_consultation(consultation_dict)
+    consultation_dict["_id"] = str(consultation_object_id)
     
     return serialize_mongo_doc(consultation_dict)
 
@@ -74,18 +70,15 @@ async def get_consultations_by_patient(
     current_user_id: str = Depends(get_current_user)
 ):
     # Verify that the patient belongs to the current user
-    patient = db.patients.find_one({
-        "_id": ObjectId(patient_id),
-        "user_id": current_user_id
-    })
+    patient = await repositories.find_patient(patient_id, current_user_id)
     
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found or not authorized")
     
     # Get consultations for this patient
-    consultations = db.consultations.find(
-        {"patient_id": patient_id},
-        {"consultation_id": 1, "date": 1, "time": 1, "description": 1, "report_txt": 1, "resources": 1, "_id": 0}
+    consultations = await repositories.find_consultations_by_patient(
+        patient_id,
+        {"consultation_id": 1, "date": 1, "time": 1, "description": 1, "report_txt": 1, "resource_count": 1, "_id": 0}
     )
     
     consultations_list = []
@@ -100,61 +93,37 @@ async def get_consultations_by_patient(
     
     return consultations_list
 
+def serialize_resource(resource: dict):
+    """Convert a consultation_resources document to JSON-serializable format"""
+    resource["created_at"] = resource["created_at"].isoformat()
+    return resource
+
 @router.get("/{consultation_id}/resources")
 async def get_all_resources(
     consultation_id: str,
+    kind: Optional[List[Literal["transcript", "question", "report"]]] = Query(None),
+    after: int = 0,
+    limit: int = Query(50, ge=1, le=200),
     current_user_id: str = Depends(get_current_user)
 ):
     """
-    Get all resources (transcriptions and chat Q&A) for a specific consultation
+    Get the resources (transcriptions, chat Q&A and reports) of a consultation,
+    oldest first, optionally only of the given kinds. Pass the returned
+    next_cursor as after to get the next page.
     """
     # Verify that the consultation exists and belongs to the current user
-    consultation = db.consultations.find_one({
-        "consultation_id": consultation_id,
-        "user_id": current_user_id
-    })
+    consultation = await repositories.find_consultation(consultation_id, current_user_id)
     
     if not consultation:
         raise HTTPException(status_code=404, detail="Consultation not found or not authorized")
     
-    # Return the resources list (list of tuples)
-    resources = consultation.get("resources", [])
-    
-    # Convert datetime objects to ISO format for JSON serialization
-    serialized_resources = []
-    for resource in resources:
-        # MongoDB stores tuples as lists, so we check for list instead of tuple
-        if isinstance(resource, (tuple, list)) and len(resource) >= 2:
-            # Handle different resource types
-            if resource[0] == 'transcript' and len(resource) == 3:
-                # ('transcript', upload_time, transcription)
-                serialized_resource = [
-                    resource[0],
-                    resource[1].isoformat() if isinstance(resource[1], datetime) else resource[1],
-                    resource[2]
-                ]
-            elif resource[0] == 'question' and len(resource) == 3:
-                # ('question', prompt, answer)
-                continue
-                # serialized_resource = list(resource)
-            elif resource[0] == 'report' and len(resource) == 3:
-                # ('report', creation_time, report_text)
-                continue 
-                # serialized_resource = [
-                #     resource[0],
-                #     resource[1].isoformat() if isinstance(resource[1], datetime) else resource[1],
-                #     resource[2]
-                # ]
-            else:
-                # Fallback for other resource types
-                serialized_resource = list(resource)
-            
-            serialized_resources.append(serialized_resource)
+    resources = await repositories.find_resources_page(consultation_id, after, kind, limit)
     
     return {
         "consultation_id": consultation_id,
-        "resources": serialized_resources,
-        "total_resources": len(serialized_resources)
+        "resources": [serialize_resource(resource) for resource in resources],
+        "next_cursor": resources[-1]["seq"] if len(resources) == limit else None,
+        "total_resources": consultation.get("resource_count", 0)
     }
 
 @router.get("/{consultation_id}")
@@ -163,22 +132,17 @@ async def get_consultation(
     current_user_id: str = Depends(get_current_user)
 ):
     """
-    Get a specific consultation with patient information and resources
+    Get a specific consultation with patient information. Its resources are
+    paginated separately on /{consultation_id}/resources.
     """
     # Verify that the consultation exists and belongs to the current user
-    consultation = db.consultations.find_one({
-        "consultation_id": consultation_id,
-        "user_id": current_user_id
-    })
+    consultation = await repositories.find_consultation(consultation_id, current_user_id)
     
     if not consultation:
         raise HTTPException(status_code=404, detail="Consultation not found or not authorized")
     
     # Get patient information
-    patient = db.patients.find_one({
-        "_id": ObjectId(consultation["patient_id"]),
-        "user_id": current_user_id
-    })
+    patient = await repositories.find_patient(consultation["patient_id"], current_user_id)
     
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
@@ -191,41 +155,6 @@ async def get_consultation(
     consultation_doc["patient_last_name"] = patient["last_name"]
     consultation_doc["patient_date_of_birth"] = patient["date_of_birth"].isoformat()
     consultation_doc["patient_description"] = patient.get("description", "")
+    consultation_doc["total_resources"] = consultation.get("resource_count", 0)
     
-    # Serialize resources
-    resources = consultation.get("resources", [])
-    serialized_resources = []
-    for resource in resources:
-        # MongoDB stores tuples as lists, so we check for list instead of tuple
-        if isinstance(resource, (tuple, list)) and len(resource) >= 2:
-            # Handle different resource types
-            if resource[0] == 'transcript' and len(resource) == 3:
-                # ('transcript', upload_time, transcription)
-                serialized_resource = [
-                    resource[0],
-                    resource[1].isoformat() if isinstance(resource[1], datetime) else resource[1],
-                    resource[2]
-                ]
-            elif resource[0] == 'question' and len(resource) == 3:
-                # ('question', prompt, answer)
-                serialized_resource = list(resource)
-            elif resource[0] == 'report' and len(resource) == 3:
-                # ('report', creation_time, report_text)
-                serialized_resource = [
-                    resource[0],
-                    resource[1].isoformat() if isinstance(resource[1], datetime) else resource[1],
-                    resource[2]
-                ]
-            else:
-                # Fallback for other resource types
-                serialized_resource = list(resource)
-            
-            serialized_resources.append(serialized_resource)
-    
-    consultation_doc["resources"] = serialized_resources
-    consultation_doc["total_resources"] = len(serialized_resources)
-    
-    print(f"Returning consultation with {len(serialized_resources)} resources")
-    print(f"Resources: {serialized_resources}")
-    
-    return consultation_doc 
\ No newline at end of file
+    return consultation_doc
@@ -1,10 +1,15 @@
-from fastapi import APIRouter
-from elise.database import db
+from fastapi import APIRouter, Depends
+from elise import repositories
+from elise.dependencies.auth import get_current_admin
 from elise.models import Membership
+from elise.quota import reload_quota
 
 router = APIRouter(prefix="/memberships", tags=["memberships"])
 
 @router.post("/")
-async def create_membership(membership: Membership):
-    result = db.memberships.insert_one(membership.dict())
-    return {"id": str(result.inserted_id)}
+async def create_membership(membership: Membership, admin: dict = Depends(get_current_admin)):
+    membership_id = await repositories.insert_membership(membership.dict())
+    # The AI endpoints count requests against the Redis copy of available,
+    # which now has to come from the new membership
+    await reload_quota(membership.user_id)
+    return {"id": str(membership_id)}
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException
 from elise.models import Patient, PatientCreate
-from elise.database import db
+from elise import repositories
 from elise.utils.auth import decode_access_token
 from fastapi.security import HTTPBearer
 from datetime import datetime
@@ -16,7 +16,7 @@ async def get_current_user(credentials = Depends(security)):
         email: str = payload.get("sub")
         if email is None:
             raise HTTPException(status_code=401, detail="Invalid authentication token")
-        user = db.users.find_one({"email": email})
+        user = await repositories.find_user_by_email(email)
         if not user:
             raise HTTPException(status_code=401, detail="User not found")
         return str(user["_id"])
@@ -50,8 +50,8 @@ async def create_patient(
     patient_dict["user_id"] = current_user_id
     patient_dict["id"] = str(ObjectId())
     
-    result = db.patients.insert_one(patient_dict)
-    patient_dict["_id"] = str(result.inserted_id)
+    patient_id = await repositories.insert_patient(patient_dict)
+    patient_dict["_id"] = str(patient_id)
     
     return serialize_mongo_doc(patient_dict)
 
@@ -59,8 +59,8 @@ async def create_patient(
 async def get_user_patients(
     current_user_id: str = Depends(get_current_user)
 ):
-    patients = db.patients.find(
-        {"user_id": current_user_id},
+    patients = await repositories.find_patients_by_user(
+        current_user_id,
         {"first_name": 1, "last_name": 1, "date_of_birth": 1, "_id": 1}
     )
     
@@ -1,5 +1,5 @@
 from fastapi import APIRouter, Depends
-from elise.database import db
+from elise import repositories
 from elise.models import UserCreate
 from datetime import datetime
 from elise.utils.auth import hash_password
@@ -9,13 +9,13 @@ router = APIRouter(prefix="/users", tags=["users"])
 
 # @router.post("/")
 # async def create_user(user: UserCreate):
-#     if db.users.find_one({"email": user.email}):
+#     if await repositories.find_user_by_email(user.email):
 #         return {"error": "Email already exists"}
 #     user_dict = user.dict()
 #     user_dict["password"] = hash_password(user.password)
 #     user_dict["creation_date"] = datetime.utcnow()
-#     result = db.users.insert_one(user_dict)
-#     return {"id": str(result.inserted_id)}
+#     user_id = await repositories.insert_user(user_dict)
+#     return {"id": str(user_id)}
 
 
 @router.get("/ping")
@@ -2,7 +2,7 @@ from fastapi import APIRouter, Request, Form, HTTPException, Depends, Query
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from elise.database import db
+from elise import repositories
 from elise.utils.auth import decode_access_token
 from datetime import datetime
 from typing import Optional
@@ -29,7 +29,7 @@ async def login_view(request: Request):
 
 @router.post("/login")
 async def login_post(request: Request, email: str = Form(...)):
-    user = db.users.find_one({"email": email})
+    user = await repositories.find_user_by_email(email)
     if user:
         return templates.TemplateResponse("dashboard.html", {
             "request": request,
@@ -64,7 +64,7 @@ async def dashboard_view(
             "error": "Please login to access the dashboard"
         })
     
-    user = db.users.find_one({"email": current_user})
+    user = await repositories.find_user_by_email(current_user)
     if not user:
         return templates.TemplateResponse("login.html", {
             "request": request,
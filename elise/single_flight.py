@@ -0,0 +1,69 @@
+import hashlib
+from .config import SINGLE_FLIGHT_LEASE_SECONDS
+from .events import redis_client, async_redis_client
+
+# Single-flight for AI tasks: a request identical to one still in flight
+# (same kind, consultation and input) gets the running task's id instead of
+# enqueuing the same work again. The flight key holds that task id with a
+# lease. It is released when the task finishes and expires on its own when
+# the worker running it dies.
+
+def flight_key(kind: str, consultation_id: str, *inputs):
+    digest = hashlib.sha256("\n".join(str(value) for value in inputs).encode()).hexdigest()
+    return f"flight:{kind}:{consultation_id}:{digest}"
+
+def _task_flight(task_id: str):
+    return f"flight:task:{task_id}"
+
+# Claim KEYS[1] for task ARGV[1], remembering the claim under KEYS[2], or
+# return the id of the task holding it
+_JOIN = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then
+    redis.call('SET', KEYS[2], KEYS[1], 'EX', ARGV[2])
+    return false
+end
+return redis.call('GET', KEYS[1])
+"""
+
+# Release KEYS[1] (ARGV[2] = 0) or renew its lease (ARGV[2] seconds) if
+# task ARGV[1] still holds it
+_RELEASE_OR_RENEW = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+if ARGV[2] == '0' then
+    redis.call('DEL', KEYS[1], KEYS[2])
+else
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    redis.call('EXPIRE', KEYS[2], ARGV[2])
+end
+return 1
+"""
+
+_join = async_redis_client.register_script(_JOIN)
+_async_release_or_renew = async_redis_client.register_script(_RELEASE_OR_RENEW)
+_release_or_renew = redis_client.register_script(_RELEASE_OR_RENEW)
+
+async def join_flight(key: str, task_id: str):
+    """
+    Claim the flight for task_id. Returns None when claimed, or the id of
+    the task already in flight for the same request.
+    """
+    return await _join(keys=[key, _task_flight(task_id)], args=[task_id, SINGLE_FLIGHT_LEASE_SECONDS])
+
+async def leave_flight(key: str, task_id: str):
+    """Give up a claim whose task could not be enqueued"""
+    await _async_release_or_renew(keys=[key, _task_flight(task_id)], args=[task_id, 0])
+
+def _update_flight(task_id: str, lease_seconds: int):
+    key = redis_client.get(_task_flight(task_id))
+    if key:
+        _release_or_renew(keys=[key, _task_flight(task_id)], args=[task_id, lease_seconds])
+
+def renew_flight(task_id: str):
+    """Start the lease of a task's flight over, if it has one"""
+    _update_flight(task_id, SINGLE_FLIGHT_LEASE_SECONDS)
+
+def release_flight(task_id: str):
+    """Let the next identical request enqueue new work"""
+    _update_flight(task_id, 0)
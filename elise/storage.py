@@ -0,0 +1,217 @@
+import asyncio
+import hashlib
+import io
+import shutil
+import tempfile
+from datetime import datetime
+from bson import ObjectId
+from gridfs import GridFSBucket, NoFile
+from .config import AUDIO_BUCKET_NAME, AUDIO_CHUNK_SIZE, AUDIO_SPOOL_MAX_MEMORY
+from .database import db
+
+# Audio blobs live in GridFS so a recording is never held in a single
+# document (MongoDB caps those at 16 MB) nor read whole into memory.
+audio_bucket = GridFSBucket(db, bucket_name=AUDIO_BUCKET_NAME, chunk_size_bytes=AUDIO_CHUNK_SIZE)
+
+async def save_upload(upload, filename: str, content_type: str, metadata: dict = None):
+    """
+    Stream an UploadFile into GridFS chunk by chunk. The blocking GridFS
+    writes run in a thread so they do not hold up the event loop.
+    Returns the blob id, its size in bytes and its SHA-256 checksum.
+    """
+    sha256 = hashlib.sha256()
+    length = 0
+    grid_in = audio_bucket.open_upload_stream(
+        filename,
+        chunk_size_bytes=AUDIO_CHUNK_SIZE,
+        metadata={**(metadata or {}), "content_type": content_type}
+    )
+    try:
+        while True:
+            chunk = await upload.read(AUDIO_CHUNK_SIZE)
+            if not chunk:
+                break
+            sha256.update(chunk)
+            length += len(chunk)
+            await asyncio.to_thread(grid_in.write, chunk)
+    except Exception:
+        await asyncio.to_thread(grid_in.abort)
+        raise
+    await asyncio.to_thread(grid_in.close)
+
+    return {
+        "blob_id": grid_in._id,
+        "length": length,
+        "sha256": sha256.hexdigest()
+    }
+
+def save_blob(source, filename: str, metadata: dict = None):
+    """
+    Stream a readable file object into GridFS chunk by chunk.
+    Returns the blob id, its size in bytes and its SHA-256 checksum.
+    """
+    sha256 = hashlib.sha256()
+    length = 0
+    with audio_bucket.open_upload_stream(
+        filename,
+        chunk_size_bytes=AUDIO_CHUNK_SIZE,
+        metadata=metadata or {}
+    ) as grid_in:
+        try:
+            while True:
+                chunk = source.read(AUDIO_CHUNK_SIZE)
+                if not chunk:
+                    break
+                sha256.update(chunk)
+                length += len(chunk)
+                grid_in.write(chunk)
+        except Exception:
+            # Do not leave the chunks written so far behind
+            grid_in.abort()
+            raise
+
+    return {
+        "blob_id": grid_in._id,
+        "length": length,
+        "sha256": sha256.hexdigest()
+    }
+
+def save_part(upload_id: str, offset: int, data: bytes):
+    """
+    Persist one byte range of a resumable upload. Writing the same range
+    again (a retried request) replaces it instead of duplicating it.
+    """
+    db.upload_parts.replace_one(
+        {"upload_id": upload_id, "offset": offset},
+        {"upload_id": upload_id, "offset": offset, "data": data, "created_at": datetime.utcnow()},
+        upsert=True
+    )
+
+class UploadGap(Exception):
+    """The stored parts of an upload are not contiguous; offset is where the valid bytes end"""
+    def __init__(self, offset: int):
+        super().__init__(f"Upload parts are not contiguous at offset {offset}")
+        self.offset = offset
+
+class UploadPartsReader:
+    """
+    Read the committed parts of a resumable upload in order as one stream.
+    Every part has to start where the previous one ended, otherwise UploadGap
+    is raised instead of assembling duplicated or missing bytes.
+    """
+    def __init__(self, upload_id: str, length: int):
+        self.parts = db.upload_parts.find(
+            {"upload_id": upload_id, "offset": {"$lt": length}}
+        ).sort("offset", 1)
+        self.position = 0
+        self.remaining = length
+        self.buffer = b""
+
+    def read(self, size: int = -1):
+        while self.remaining and (size < 0 or len(self.buffer) < size):
+            part = next(self.parts, None)
+            if part is None or part["offset"] != self.position:
+                raise UploadGap(self.position)
+            data = part["data"][:self.remaining]
+            self.position += len(data)
+            self.remaining -= len(data)
+            self.buffer += data
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+def delete_parts(upload_id: str, from_offset: int = 0):
+    """Delete the stored parts of a resumable upload, from the given offset on"""
+    db.upload_parts.delete_many({"upload_id": upload_id, "offset": {"$gte": from_offset}})
+
+class AudioSpool:
+    """
+    A growable byte buffer kept in memory up to max_memory and moved to an
+    anonymous temporary file beyond that, so typical recordings never touch
+    the disk and large ones never sit whole in memory.
+    """
+    def __init__(self, max_memory: int = AUDIO_SPOOL_MAX_MEMORY):
+        self.max_memory = max_memory
+        self.file = io.BytesIO()
+        self.path = None
+
+    def move_to_disk(self):
+        if self.path:
+            return
+        position = self.file.tell()
+        disk = tempfile.NamedTemporaryFile(prefix="elise_audio_")
+        with self.file.getbuffer() as view:
+            disk.write(view)
+        disk.seek(position)
+        self.file.close()
+        self.file = disk
+        self.path = disk.name
+
+    def write(self, data):
+        if self.path is None and self.file.tell() + len(data) > self.max_memory:
+            self.move_to_disk()
+        return self.file.write(data)
+
+    def read(self, size: int = -1):
+        return self.file.read(size)
+
+    def seek(self, offset: int, whence: int = 0):
+        return self.file.seek(offset, whence)
+
+    def size(self):
+        self.file.flush()
+        position = self.file.tell()
+        size = self.file.seek(0, io.SEEK_END)
+        self.file.seek(position)
+        return size
+
+    def blocks(self, block_size: int = AUDIO_CHUNK_SIZE):
+        """Yield the whole content from the start in blocks"""
+        self.file.seek(0)
+        while True:
+            block = self.file.read(block_size)
+            if not block:
+                break
+            yield block
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def spool_blob(blob_id):
+    """
+    Read a stored blob into an AudioSpool, going straight to disk when the
+    blob is larger than the memory limit
+    """
+    spool = AudioSpool()
+    with open_blob(blob_id) as grid_out:
+        if grid_out.length > spool.max_memory:
+            spool.move_to_disk()
+        shutil.copyfileobj(grid_out, spool, AUDIO_CHUNK_SIZE)
+    spool.seek(0)
+    return spool
+
+def open_blob(blob_id):
+    """Open a stored blob as a read-only file-like stream"""
+    return audio_bucket.open_download_stream(ObjectId(blob_id))
+
+def delete_blob(blob_id):
+    """Delete a stored blob, ignoring blobs that are already gone"""
+    try:
+        audio_bucket.delete(ObjectId(blob_id))
+    except NoFile:
+        pass
+
+def delete_blobs_before(cutoff_time: datetime):
+    """Delete every blob uploaded before the cutoff time"""
+    deleted = 0
+    for grid_out in audio_bucket.find({"uploadDate": {"$lt": cutoff_time}}):
+        delete_blob(grid_out._id)
+        deleted += 1
+    return deleted
@@ -1,7 +1,51 @@
-from celery import Celery
-from .openai_helper import transcribe_audio, complete_chat, create_report
+from celery import Celery, chord, group
+from kombu import Exchange, Queue
+from celery.exceptions import ChordError
+from celery.signals import task_prerun, task_postrun, task_success, task_failure
+from .openai_helper import transcribe_audio, continue_chat, create_report, update_report, ConversationExpired
 from .database import db
-import tempfile
+from .storage import spool_blob, save_blob, delete_blob, delete_blobs_before
+from .cache import get_cached_transcript, store_transcript
+from .context import assemble_context
+from .resources import add_resource, find_resources
+from .chat_sessions import get_chat_session, save_chat_session, reset_chat_session
+from .answer_cache import answer_cache_key, resource_version, get_cached_answer, store_answer
+from .events import TokenStream, publish_task_event, publish_stream_event
+from .task_registry import set_task_state
+from .single_flight import renew_flight, release_flight
+from .admission import task_started, task_finished, release_user_task
+from .quota import settle_quota, refund_quota, sync_quotas
+from .audio import (
+    SAMPLE_RATE,
+    NORMALIZED_EXTENSION,
+    decode_to_pcm,
+    pcm_samples,
+    pcm_sha256,
+    frame_energies,
+    speech_threshold,
+    detect_speech,
+    compact_speech,
+    to_original_time,
+    plan_segments,
+    encode_pcm,
+    merge_transcripts
+)
+from .config import (
+    TEMP_FILE_TTL_SECONDS,
+    QUOTA_SYNC_SECONDS,
+    AUDIO_NORMALIZED_BITRATE,
+    TRANSCRIBE_SEGMENT_SECONDS,
+    TRANSCRIBE_OVERLAP_SECONDS,
+    TRANSCRIBE_SILENCE_SEARCH_SECONDS,
+    TRANSCRIBE_MAX_PARALLEL,
+    VAD_ENABLED,
+    VAD_THRESHOLD_RATIO,
+    VAD_MIN_RMS,
+    VAD_MIN_SILENCE_SECONDS,
+    VAD_PADDING_SECONDS,
+    VAD_CALIBRATION_SECONDS
+)
+import time
 import os
 from datetime import datetime, timedelta
 
@@ -11,152 +55,524 @@ celery_app = Celery(
     backend=os.getenv("CELERY_BACKEND")
 )
 
+# The pool is chosen on the command line (--pool=gevent for I/O workers, see
+# celery_worker.py): gevent only monkey-patches the standard library when
+# it is selected there, before anything else is imported
+if os.getenv("CELERY_CONCURRENCY"):
+    celery_app.conf.worker_concurrency = int(os.getenv("CELERY_CONCURRENCY"))
+
+# Interactive chat, reports and transcription batches get their own queues,
+# so a transcription backlog never sits in front of a question. A worker
+# consuming several of them (-Q chat,reports,transcription) drains them in
+# that order. Within a queue, lower priority numbers go first.
+CHAT_QUEUE = "chat"
+REPORTS_QUEUE = "reports"
+TRANSCRIPTION_QUEUE = "transcription"
+MAINTENANCE_QUEUE = "maintenance"
+INTERACTIVE_PRIORITY = 0
+BATCH_PRIORITY = 5
+
+celery_app.conf.task_queues = [
+    Queue(queue, Exchange(queue), routing_key=queue)
+    for queue in (CHAT_QUEUE, REPORTS_QUEUE, TRANSCRIPTION_QUEUE, MAINTENANCE_QUEUE)
+]
+celery_app.conf.task_default_queue = MAINTENANCE_QUEUE
+celery_app.conf.task_routes = {
+    "tasks.complete_chat_task": {"queue": CHAT_QUEUE},
+    "tasks.create_report_task": {"queue": REPORTS_QUEUE},
+    "tasks.transcribe_audio_task": {"queue": TRANSCRIPTION_QUEUE},
+    "tasks.transcribe_segment_task": {"queue": TRANSCRIPTION_QUEUE},
+    "tasks.merge_segments_task": {"queue": TRANSCRIPTION_QUEUE},
+    "tasks.transcription_failed_task": {"queue": TRANSCRIPTION_QUEUE},
+    "tasks.cleanup_temp_files": {"queue": MAINTENANCE_QUEUE},
+    "tasks.sync_quotas": {"queue": MAINTENANCE_QUEUE},
+}
+celery_app.conf.task_default_priority = BATCH_PRIORITY
+celery_app.conf.broker_transport_options = {
+    "priority_steps": list(range(10)),
+    "queue_order_strategy": "priority",
+}
+# Long transcriptions should not be reserved by a busy worker while another
+# one is idle; raise it for workers that only run short tasks
+celery_app.conf.worker_prefetch_multiplier = int(os.getenv("CELERY_PREFETCH_MULTIPLIER", "1"))
+
 # Configure Celery Beat schedule
 celery_app.conf.beat_schedule = {
     'cleanup-temp-files-daily': {
         'task': 'tasks.cleanup_temp_files',
         'schedule': 86400.0,  # 24 hours in seconds
     },
+    'sync-quotas': {
+        'task': 'tasks.sync_quotas',
+        'schedule': QUOTA_SYNC_SECONDS,
+    },
 }
 
-@celery_app.task(name="tasks.transcribe_audio_task")
-def transcribe_audio_task(file_id: str, consultation_id: str):
-    temp_file_path = None
-    try:
-        # Get the file from MongoDB
-        temp_file_doc = db.temp_files.find_one({"file_id": file_id})
-        if not temp_file_doc:
-            raise Exception(f"File with ID {file_id} not found in database")
-        
-        # Create a temporary file to work with OpenAI API
-        temp_dir = tempfile.gettempdir()
-        file_extension = os.path.splitext(temp_file_doc["filename"])[1] if temp_file_doc["filename"] else '.webm'
-        temp_file_path = os.path.join(temp_dir, f"audio_{file_id}{file_extension}")
-        
-        # Write the file data to temporary file
-        with open(temp_file_path, "wb") as f:
-            f.write(temp_file_doc["file_data"])
-        
-        # Transcribe the audio
-        transcription = transcribe_audio(temp_file_path)
-        
-        # Get the upload time from the temp file document
-        upload_time = temp_file_doc["created_at"]
-        
-        # Add the transcription to the consultation's resources list as a tuple
-        transcription_tuple = ('transcript', upload_time, transcription)
-        db.consultations.update_one(
-            {"consultation_id": consultation_id},
-            {"$push": {"resources": transcription_tuple}}
-        )
-        
-        # Clean up the temporary file
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+def _task_queue(task):
+    return (task.request.delivery_info or {}).get("routing_key")
+
+# Record the state changes of every task and publish them on the task-event
+# bus. A finished task also releases its single-flight claim and its slot
+# in the user's admission limit; a failed one gets its quota back.
+@task_prerun.connect
+def _publish_task_started(task_id=None, task=None, **kwargs):
+    set_task_state(task_id, "started")
+    publish_task_event(task_id, "started")
+    # Segments and the merge of a transcription keep its flight alive
+    renew_flight(task.request.root_id or task_id)
+    if _task_queue(task):
+        task_started(task_id, _task_queue(task))
+
+@task_postrun.connect
+def _record_task_time(task_id=None, task=None, **kwargs):
+    if _task_queue(task):
+        task_finished(task_id, _task_queue(task))
+
+@task_success.connect
+def _publish_task_done(sender=None, result=None, **kwargs):
+    set_task_state(sender.request.id, "done", result=result if isinstance(result, str) else None)
+    publish_task_event(sender.request.id, "done")
+    release_flight(sender.request.id)
+    release_user_task(sender.request.id)
+    settle_quota(sender.request.id)
+
+@task_failure.connect
+def _publish_task_failed(task_id=None, exception=None, **kwargs):
+    _fail_task(task_id, exception)
+
+def _fail_task(task_id: str, exception):
+    set_task_state(task_id, "failed", error=str(exception))
+    publish_task_event(task_id, "failed", error=str(exception))
+    release_flight(task_id)
+    release_user_task(task_id)
+    refund_quota(task_id)
+
+def _finish_transcription(file_id: str, consultation_id: str, transcription: str):
+    """
+    Append a transcription to the consultation and drop the uploaded audio
+    """
+    temp_file_doc = db.temp_files.find_one({"file_id": file_id})
+    if not temp_file_doc:
+        raise Exception(f"File with ID {file_id} not found in database")
+    
+    # Get the upload time from the temp file document
+    upload_time = temp_file_doc["created_at"]
+    
+    # Recordings without any speech do not add a resource
+    if transcription:
+        add_resource(consultation_id, "transcript", transcription, created_at=upload_time)
+    
+    # Delete the temp file and its blob from MongoDB after processing
+    delete_blob(temp_file_doc["blob_id"])
+    db.temp_files.delete_one({"file_id": file_id})
+
+def _record_audio_stats(file_id: str, consultation_id: str, stats: dict, offset_map: list):
+    """
+    Store how much the normalization and VAD stages saved for one file
+    """
+    stats["bytes_saved"] = stats["original_bytes"] - stats["normalized_bytes"]
+    db.audio_stats.insert_one({
+        "file_id": file_id,
+        "consultation_id": consultation_id,
+        **stats,
+        "offset_map": offset_map,
+        "created_at": datetime.utcnow()
+    })
+    print(
+        f"Normalized {file_id}: {stats['original_bytes']} -> {stats['normalized_bytes']} bytes, "
+        f"removed {stats['removed_seconds']:.1f}s of {stats['duration_seconds']:.1f}s as silence"
+    )
+
+def _prepare_audio(source):
+    """
+    Decode audio to mono 16 kHz PCM and drop long silences.
+    Returns the speech samples, the map from their timeline back to the
+    original recording and the stats of both stages.
+    """
+    decode_started = time.perf_counter()
+    with decode_to_pcm(source) as pcm:
+        samples = pcm_samples(pcm)
+    duration = len(samples) / SAMPLE_RATE
+    offset_map = [[0.0, 0.0, duration]]
+    
+    vad_started = time.perf_counter()
+    if VAD_ENABLED:
+        energies = frame_energies(samples)
+        threshold = speech_threshold(energies, VAD_THRESHOLD_RATIO, VAD_MIN_RMS, VAD_CALIBRATION_SECONDS)
+        regions = detect_speech(energies, threshold, VAD_MIN_SILENCE_SECONDS, VAD_PADDING_SECONDS)
+        samples, offset_map = compact_speech(samples, regions)
+    
+    speech_seconds = len(samples) / SAMPLE_RATE
+    return samples, offset_map, {
+        "original_bytes": source.size(),
+        "normalized_bytes": 0,
+        "duration_seconds": duration,
+        "speech_seconds": speech_seconds,
+        "removed_seconds": duration - speech_seconds,
+        "decode_seconds": vad_started - decode_started,
+        "vad_seconds": time.perf_counter() - vad_started,
+        "encode_seconds": 0.0,
+        "spooled_to_disk": source.path is not None
+    }
+
+@celery_app.task(name="tasks.transcribe_audio_task", bind=True)
+def transcribe_audio_task(self, file_id: str, consultation_id: str):
+    """
+    Transcribe an uploaded recording. The audio is first normalized to 16 kHz
+    mono and long silences are removed; short recordings are then sent in one
+    call and long ones are cut at silence into overlapping segments that are
+    transcribed in parallel and merged back together by a chord.
+    """
+    # Get the file from MongoDB
+    temp_file_doc = db.temp_files.find_one({"file_id": file_id})
+    if not temp_file_doc:
+        raise Exception(f"File with ID {file_id} not found in database")
+    
+    # Read the blob into memory, or onto disk when it is large
+    with spool_blob(temp_file_doc["blob_id"]) as source:
+        samples, offset_map, stats = _prepare_audio(source)
+    
+    if not len(samples):
+        # Nothing but silence, no need to call the API
+        _record_audio_stats(file_id, consultation_id, stats, offset_map)
+        _finish_transcription(file_id, consultation_id, "")
+        return ""
+    
+    # The same recording uploaded twice is only transcribed once
+    audio_hash = pcm_sha256(samples)
+    transcription = get_cached_transcript(audio_hash)
+    if transcription is not None:
+        print(f"Transcription cache hit for {file_id}")
+        stats["cache_hit"] = True
+        _record_audio_stats(file_id, consultation_id, stats, offset_map)
+        _finish_transcription(file_id, consultation_id, transcription)
+        return transcription
+    
+    segments = plan_segments(
+        samples,
+        TRANSCRIBE_SEGMENT_SECONDS,
+        TRANSCRIBE_OVERLAP_SECONDS,
+        TRANSCRIBE_SILENCE_SEARCH_SECONDS,
+        TRANSCRIBE_MAX_PARALLEL
+    )
+    set_task_state(self.request.id, "progress", segments=len(segments))
+    publish_task_event(self.request.id, "progress", segments=len(segments))
+    
+    # Encode every segment that is not cached yet as compact Opus for upload
+    segment_tasks = []
+    cached_results = []
+    encode_started = time.perf_counter()
+    for index, (start, end) in enumerate(segments):
+        segment_samples = samples[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)]
+        segment_hash = audio_hash if len(segments) == 1 else pcm_sha256(segment_samples)
+        original_start = to_original_time(offset_map, start)
+        original_end = to_original_time(offset_map, end)
         
-        # Delete the temp file from MongoDB after processing
-        db.temp_files.delete_one({"file_id": file_id})
+        text = get_cached_transcript(segment_hash)
+        if text is not None:
+            cached_results.append({"index": index, "start": original_start, "end": original_end, "text": text})
+            continue
         
+        with encode_pcm(segment_samples, AUDIO_NORMALIZED_BITRATE) as segment:
+            stats["normalized_bytes"] += segment.size()
+            
+            if len(segments) == 1:
+                # Short recording, transcribe the normalized audio directly
+                transcription = transcribe_audio(segment.file, f"{file_id}{NORMALIZED_EXTENSION}")
+                store_transcript(audio_hash, transcription)
+                break
+            
+            # Store the segment as its own blob for the segment workers,
+            # reporting its position in the original recording
+            segment.seek(0)
+            blob = save_blob(segment, f"segment_{file_id}_{index}{NORMALIZED_EXTENSION}", metadata={"file_id": file_id})
+        segment_tasks.append(transcribe_segment_task.s(
+            str(blob["blob_id"]),
+            index,
+            original_start,
+            original_end,
+            NORMALIZED_EXTENSION,
+            segment_hash
+        ))
+    stats["encode_seconds"] = time.perf_counter() - encode_started
+    stats["cached_segments"] = len(cached_results)
+    _record_audio_stats(file_id, consultation_id, stats, offset_map)
+    
+    if transcription is not None:
+        _finish_transcription(file_id, consultation_id, transcription)
         return transcription
-    except Exception as e:
-        # Clean up the temporary file even if transcription fails
-        if temp_file_path and os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
-        raise e
+    
+    if not segment_tasks:
+        # Every segment was already cached
+        return merge_segments_task(cached_results, file_id, consultation_id, audio_hash)
+    
+    print(f"Transcribing {file_id} as {len(segment_tasks)} parallel segments ({len(cached_results)} cached)")
+    
+    # Fan out the segments and merge them back into this task's result
+    raise self.replace(chord(
+        group(segment_tasks),
+        _merge_signature(file_id, consultation_id, audio_hash, cached_results)
+    ))
 
-@celery_app.task(name="tasks.complete_chat_task")
-def complete_chat_task(prompt: str, consultation_id: str):
-    # Get the chat completion from OpenAI
+def _merge_signature(file_id: str, consultation_id: str, audio_hash: str, cached_results: list):
+    """
+    The chord body merging the segments. It takes over the id of the
+    transcription task it replaces, so a failed segment has to fail that
+    id through the errback: no task with it runs to fire task_failure.
+    """
+    return merge_segments_task.s(file_id, consultation_id, audio_hash, cached_results).on_error(
+        transcription_failed_task.s()
+    )
+
+# A segment only produces its text, so a segment lost with its worker is
+# simply run again
+@celery_app.task(name="tasks.transcribe_segment_task", acks_late=True, reject_on_worker_lost=True)
+def transcribe_segment_task(
+    blob_id: str,
+    index: int,
+    start: float,
+    end: float,
+    extension: str = NORMALIZED_EXTENSION,
+    audio_hash: str = None,
+    stream_id: str = None
+):
+    """
+    Transcribe one segment of a long recording or one live-streamed window.
+    Audio that was not normalized yet (live windows) goes through the
+    normalization and VAD stages first. With stream_id (live windows) the
+    result or the error is also published on that stream.
+    """
     try:
-        # Get the consultation and its resources
-        consultation = db.consultations.find_one({"consultation_id": consultation_id})
-        if not consultation:
-            raise Exception(f"Consultation with ID {consultation_id} not found")
-        
-        resources = consultation.get("resources", [])
-        if not resources:
-            raise Exception("No resources found for this consultation")
-        
-        # Concatenate all resources into a single text
-        resources_text = ""
-        for resource in resources:
-            # MongoDB stores tuples as lists, so we check for list instead of tuple
-            if isinstance(resource, (tuple, list)) and len(resource) >= 2:
-                if resource[0] == 'transcript' and len(resource) == 3:
-                    # Format: ('transcript', upload_time, transcription)
-                    resources_text += f"Transcripción ({resource[1]}): {resource[2]}\n\n"
-                elif resource[0] == 'question' and len(resource) == 3:
-                    # Format: ('question', prompt, answer)
-                    resources_text += f"Pregunta: {resource[1]}\nRespuesta: {resource[2]}\n\n"
-        
-        # Create the report using OpenAI
-        print(f"Resources of {consultation_id} text: {resources_text}")
+        text = _transcribe_segment(blob_id, index, extension, audio_hash)
+    except Exception as exc:
+        if stream_id:
+            publish_stream_event(stream_id, "segment_error", index=index, detail=str(exc))
+        raise
+    
+    result = {"index": index, "start": start, "end": end, "text": text}
+    if stream_id:
+        publish_stream_event(stream_id, "segment", **result)
+    return result
 
-        prompt += "Context: " + resources_text
+def _transcribe_segment(blob_id: str, index: int, extension: str, audio_hash: str):
+    segment = spool_blob(blob_id)
+    try:
+        text = None
+        if extension != NORMALIZED_EXTENSION:
+            samples, offset_map, stats = _prepare_audio(segment)
+            if not len(samples):
+                text = ""
+            else:
+                audio_hash = pcm_sha256(samples)
+                text = get_cached_transcript(audio_hash)
+                if text is None:
+                    encode_started = time.perf_counter()
+                    segment.close()
+                    segment = encode_pcm(samples, AUDIO_NORMALIZED_BITRATE)
+                    stats["encode_seconds"] = time.perf_counter() - encode_started
+                    stats["normalized_bytes"] = segment.size()
+            _record_audio_stats(blob_id, None, stats, offset_map)
         
-        answer = complete_chat(prompt)
-        # Add the chat Q&A to the consultation's resources list as a tuple
-        chat_tuple = ('question', prompt, answer)
-        db.consultations.update_one(
-            {"consultation_id": consultation_id},
-            {"$push": {"resources": chat_tuple}}
-        )
+        if text is None:
+            text = transcribe_audio(segment.file, f"segment_{index}{NORMALIZED_EXTENSION}")
+            if audio_hash:
+                store_transcript(audio_hash, text)
+    finally:
+        segment.close()
+    
+    delete_blob(blob_id)
+    return text
+
+@celery_app.task(name="tasks.merge_segments_task")
+def merge_segments_task(results: list, file_id: str, consultation_id: str, audio_hash: str = None, cached_results: list = None):
+    """
+    Stitch the segment transcripts back into a single transcript resource
+    """
+    results = results + (cached_results or [])
+    pieces = [result["text"] for result in sorted(results, key=lambda result: result["index"])]
+    transcription = merge_transcripts(pieces)
+    if audio_hash:
+        store_transcript(audio_hash, transcription)
+    _finish_transcription(file_id, consultation_id, transcription)
+    return transcription
+
+@celery_app.task(name="tasks.transcription_failed_task")
+def transcription_failed_task(request, exc, traceback):
+    """
+    Errback of the segment chord, called with the request of the merge
+    (which carries the id of the original transcription task)
+    """
+    # A failure of the merge itself already went through task_failure
+    if isinstance(exc, ChordError):
+        _fail_task(request.id, exc)
+
+@celery_app.task(bind=True, name="tasks.complete_chat_task", priority=INTERACTIVE_PRIORITY)
+def complete_chat_task(self, prompt: str, consultation_id: str, stream: bool = False):
+    # With stream the answer tokens are relayed to the browser as they arrive
+    token_stream = TokenStream(self.request.id) if stream else None
+    # Get the chat completion from OpenAI
+    try:
+        # The same question about the same transcripts is answered from the cache
+        version = resource_version(consultation_id, ["transcript"])
+        cache_key = answer_cache_key("chat", consultation_id, version, prompt)
+        cached_answer = get_cached_answer(cache_key, "chat")
+        if cached_answer is not None:
+            print(f"Answer cache hit for {consultation_id}")
+            answer = cached_answer
+            if token_stream:
+                token_stream(answer)
+            add_resource(consultation_id, "question", answer, question=prompt, context_seq=version)
+        else:
+            answer = None
+            session = get_chat_session(consultation_id)
+            if session:
+                # Follow-up question: the conversation already holds the context
+                # and earlier turns, only send what was transcribed since
+                new_resources = find_resources(consultation_id, after_seq=session["context_seq"], kinds=["transcript"])
+                new_resources_text = assemble_context(new_resources)
+                turn_prompt = f"Nueva información:\n{new_resources_text}\n{prompt}" if new_resources_text else prompt
+                try:
+                    answer, response_id = continue_chat(turn_prompt, session["response_id"], on_delta=token_stream)
+                    context_seq = new_resources[-1]["seq"] if new_resources else session["context_seq"]
+                    turns = session["turns"] + 1
+                except ConversationExpired:
+                    print(f"Chat session of {consultation_id} expired on OpenAI, starting a new one")
+                    reset_chat_session(consultation_id)
+            
+            if answer is None:
+                # Get the consultation's resources
+                resources = find_resources(consultation_id)
+                if not resources:
+                    raise Exception("No resources found for this consultation")
+            
+                # Build the context from the resources within the token budget
+                resources_text = assemble_context(resources, question=prompt)
+            
+                # Create the report using OpenAI
+                print(f"Resources of {consultation_id} text: {resources_text}")
+            
+                answer, response_id = continue_chat(prompt + "Context: " + resources_text, on_delta=token_stream)
+                context_seq = resources[-1]["seq"]
+                turns = 1
+            
+            # Add the chat Q&A to the consultation's resources. Only the question
+            # is stored, with the seq of the last resource the context covered.
+            add_resource(consultation_id, "question", answer, question=prompt, context_seq=context_seq)
+            # The session continues from what was sent, not from the Q&A just
+            # added: a transcript saved while OpenAI was answering lies between
+            save_chat_session(consultation_id, response_id, context_seq, turns)
+            store_answer(cache_key, answer)
     except Exception as e:
+        if token_stream:
+            token_stream.error(str(e))
         raise e
     
-    
+    if token_stream:
+        token_stream.done(answer)
     return answer
 
-@celery_app.task(name="tasks.create_report_task")
-def create_report_task(consultation_id: str):
+@celery_app.task(bind=True, name="tasks.create_report_task")
+def create_report_task(self, consultation_id: str, mode: str = "incremental", stream: bool = False):
     """
-    Create a summary report from all resources in a consultation
+    Create a summary report from the resources in a consultation.
+    In incremental mode only the resources added since the last report
+    (after report_watermark) are merged into the existing report; "full"
+    regenerates it from every resource.
+    With stream the report tokens are relayed to the browser as they arrive.
     """
+    token_stream = TokenStream(self.request.id) if stream else None
     try:
         # Get the consultation and its resources
-        consultation = db.consultations.find_one({"consultation_id": consultation_id})
+        consultation = db.consultations.find_one(
+            {"consultation_id": consultation_id},
+            {"report_txt": 1, "report_watermark": 1, "resource_count": 1}
+        )
         if not consultation:
             raise Exception(f"Consultation with ID {consultation_id} not found")
         
-        resources = consultation.get("resources", [])
-        if not resources:
+        if not consultation.get("resource_count"):
             raise Exception("No resources found for this consultation")
         
-        # Concatenate all resources into a single text
-        resources_text = ""
-        for resource in resources:
-            # MongoDB stores tuples as lists, so we check for list instead of tuple
-            if isinstance(resource, (tuple, list)) and len(resource) >= 2:
-                if resource[0] == 'transcript' and len(resource) == 3:
-                    # Format: ('transcript', upload_time, transcription)
-                    resources_text += f"Transcripción ({resource[1]}): {resource[2]}\n\n"
-                elif resource[0] == 'question' and len(resource) == 3:
-                    # Format: ('question', prompt, answer)
-                    resources_text += f"Pregunta: {resource[1]}\nRespuesta: {resource[2]}\n\n"
+        previous_report = consultation.get("report_txt", "")
+        watermark = consultation.get("report_watermark")
         
-        # Create the report using OpenAI
-        print(f"Resources of {consultation_id} text: {resources_text}")
-        report_text = create_report(resources_text)
+        # A report of the same transcripts and Q&A is served from the cache,
+        # unless a full regeneration was asked for explicitly
+        cache_key = answer_cache_key("report", consultation_id, resource_version(consultation_id, ["transcript", "question"]))
+        cached_report = get_cached_answer(cache_key, "report") if mode != "full" else None
+        if cached_report is not None:
+            print(f"Report cache hit for {consultation_id}")
+            if cached_report != previous_report:
+                db.consultations.update_one(
+                    {"consultation_id": consultation_id},
+                    {"$set": {"report_txt": cached_report, "report_watermark": consultation["resource_count"]}}
+                )
+                add_resource(consultation_id, "report", cached_report)
+            if token_stream:
+                token_stream(cached_report)
+                token_stream.done(cached_report)
+            return cached_report
         
-        # Add the report to the consultation's resources list as a tuple
-        report_tuple = ('report', datetime.utcnow(), report_text)
+        if mode == "incremental" and previous_report and watermark is not None:
+            # Only fold in what was added since the last report
+            resources = find_resources(consultation_id, after_seq=watermark)
+            new_resources_text = assemble_context(resources)
+            if not new_resources_text:
+                print(f"Report of {consultation_id} is up to date")
+                if token_stream:
+                    token_stream.done(previous_report)
+                return previous_report
+            
+            print(f"Updating report of {consultation_id} with {len(resources)} new resources")
+            report_text = update_report(previous_report, new_resources_text, on_delta=token_stream)
+        else:
+            resources = find_resources(consultation_id)
+            # Build the context from all resources within the token budget
+            resources_text = assemble_context(resources)
+            
+            # Create the report using OpenAI
+            print(f"Resources of {consultation_id} text: {resources_text}")
+            report_text = create_report(resources_text, on_delta=token_stream)
         
-        # Update the consultation with the report in both report_txt field and resources array
+        # Update the consultation with the report, remembering the last
+        # resource it covers, and add it to the resources
         db.consultations.update_one(
             {"consultation_id": consultation_id},
-            {
-                "$set": {"report_txt": report_text},
-                "$push": {"resources": report_tuple}
-            }
+            {"$set": {"report_txt": report_text, "report_watermark": resources[-1]["seq"] if resources else watermark}}
         )
+        add_resource(consultation_id, "report", report_text)
+        store_answer(cache_key, report_text)
         
+        if token_stream:
+            token_stream.done(report_text)
         return report_text
     except Exception as e:
+        if token_stream:
+            token_stream.error(str(e))
         raise e
 
-@celery_app.task(name="tasks.cleanup_temp_files")
+@celery_app.task(name="tasks.cleanup_temp_files", acks_late=True)
 def cleanup_temp_files():
-    """Clean up temporary files older than 24 hours"""
-    cutoff_time = datetime.utcnow() - timedelta(hours=24)
-    result = db.temp_files.delete_many({"created_at": {"$lt": cutoff_time}})
-    return f"Cleaned up {result.deleted_count} old temporary files"
+    """
+    Clean up audio blobs and abandoned uploads older than 24 hours. The
+    temp_files documents themselves expire through their TTL index.
+    """
+    cutoff_time = datetime.utcnow() - timedelta(seconds=TEMP_FILE_TTL_SECONDS)
+    deleted_blobs = delete_blobs_before(cutoff_time)
+    
+    # Drop resumable uploads that were abandoned before being finalized
+    stale_uploads = db.upload_sessions.find({"updated_at": {"$lt": cutoff_time}}, {"upload_id": 1})
+    stale_upload_ids = [session["upload_id"] for session in stale_uploads]
+    db.upload_parts.delete_many({"upload_id": {"$in": stale_upload_ids}})
+    db.upload_sessions.delete_many({"upload_id": {"$in": stale_upload_ids}})
+    
+    return (
+        f"Cleaned up {deleted_blobs} audio blobs and {len(stale_upload_ids)} abandoned uploads"
+    )
+
+@celery_app.task(name="tasks.sync_quotas", acks_late=True)
+def sync_quotas_task():
+    """
+    Write the AI request counters changed in Redis back to memberships
+    """
+    return f"Synced the quota of {sync_quotas()} users"
@@ -0,0 +1,53 @@
+from datetime import datetime
+from .database import db
+
+# Every task started on behalf of a user is recorded in the tasks collection
+# when it is enqueued and updated by the workers on each state change, so its
+# status outlives the Celery result backend and can be queried in bulk.
+
+FINAL_TASK_STATES = ("done", "failed")
+
+def record_task(task_id: str, user_id: str, consultation_id: str, kind: str):
+    """Record a task that is about to be enqueued"""
+    now = datetime.utcnow()
+    db.tasks.update_one(
+        {"task_id": task_id},
+        {
+            "$set": {"state": "queued", "updated_at": now},
+            "$setOnInsert": {
+                "user_id": user_id,
+                "consultation_id": consultation_id,
+                "kind": kind,
+                "created_at": now
+            }
+        },
+        upsert=True
+    )
+
+def set_task_state(task_id: str, state: str, **data):
+    """
+    Update the state of a recorded task. Tasks that are not recorded, such as
+    the segments of a long recording, are ignored, and a finished task keeps
+    its final state.
+    """
+    db.tasks.update_one(
+        {"task_id": task_id, "state": {"$nin": list(FINAL_TASK_STATES)}},
+        {"$set": {"state": state, "updated_at": datetime.utcnow(), **data}}
+    )
+
+def find_tasks(user_id: str, task_ids: list = None, consultation_id: str = None, active_only: bool = False):
+    """Return the recorded tasks of a user matching the given filters, newest first"""
+    query = {"user_id": user_id}
+    if task_ids:
+        query["task_id"] = {"$in": task_ids}
+    if consultation_id:
+        query["consultation_id"] = consultation_id
+    if active_only:
+        query["state"] = {"$nin": list(FINAL_TASK_STATES)}
+
+    tasks = []
+    for task in db.tasks.find(query, {"_id": 0}).sort("created_at", -1):
+        task["created_at"] = task["created_at"].isoformat()
+        task["updated_at"] = task["updated_at"].isoformat()
+        tasks.append(task)
+    return tasks
@@ -0,0 +1,32 @@
+import json
+import secrets
+from .config import STREAM_TICKET_TTL_SECONDS
+from .events import async_redis_client
+
+# Tickets for the connections that cannot send an Authorization header
+# (EventSource and WebSocket). They go in the query string instead of the
+# access token, so what ends up in access logs is already used up or
+# expires within STREAM_TICKET_TTL_SECONDS. A ticket is only good for the
+# scope it was issued for: "events", "stream:<task_id>" or
+# "transcribe:<consultation_id>".
+
+def _ticket_key(ticket: str):
+    return f"ticket:{ticket}"
+
+async def issue_ticket(user_id: str, scope: str):
+    """Return a new single-use ticket of the user for the scope"""
+    ticket = secrets.token_urlsafe(32)
+    await async_redis_client.set(
+        _ticket_key(ticket),
+        json.dumps({"user_id": user_id, "scope": scope}),
+        ex=STREAM_TICKET_TTL_SECONDS
+    )
+    return ticket
+
+async def redeem_ticket(ticket: str, scope: str):
+    """Use up a ticket and return its user id, or None when it is unknown, used, expired or for another scope"""
+    raw = await async_redis_client.getdel(_ticket_key(ticket))
+    if raw is None:
+        return None
+    data = json.loads(raw)
+    return data["user_id"] if data["scope"] == scope else None
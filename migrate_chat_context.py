@@ -0,0 +1,36 @@
+from pymongo import UpdateOne
+from elise.context import count_tokens
+from elise.database import db
+
+# One-shot migration that strips the prompt context chat questions used to
+# be stored with ("<question>Context: <every resource>"), keeping only the
+# question the user asked. Run after migrate_resources.py with:
+#   python migrate_chat_context.py
+
+CONTEXT_MARKER = "Context: "
+
+def main():
+    stripped = 0
+    operations = []
+    for resource in db.consultation_resources.find(
+        {"kind": "question", "question": {"$regex": CONTEXT_MARKER}},
+        {"question": 1, "text": 1}
+    ):
+        # Older questions were themselves part of later contexts, so the
+        # user's question is what comes before the first marker
+        question = resource["question"].split(CONTEXT_MARKER, 1)[0]
+        operations.append(UpdateOne(
+            {"_id": resource["_id"]},
+            {"$set": {"question": question, "token_count": count_tokens(resource["text"] + question)}}
+        ))
+        stripped += 1
+        if len(operations) == 1000:
+            db.consultation_resources.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        db.consultation_resources.bulk_write(operations, ordered=False)
+
+    print(f"Stripped the embedded context of {stripped} chat questions")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+from datetime import datetime
+from pymongo import UpdateOne
+from elise.database import db
+from elise.resources import build_resource
+
+# One-shot migration of the resources arrays embedded in consultations to
+# the consultation_resources collection. Run with:
+#   python migrate_resources.py
+# It is safe to run again: resources already moved are left as they are.
+
+def legacy_to_resource(consultation_id: str, seq: int, resource: list):
+    """Convert a ('transcript' | 'question' | 'report', ...) tuple to a resource document"""
+    kind, first, second = resource
+    if kind == "question":
+        # ('question', prompt, answer)
+        return build_resource(consultation_id, seq, "question", second, question=first)
+    # ('transcript', upload_time, text) and ('report', creation_time, text)
+    created_at = first if isinstance(first, datetime) else None
+    return build_resource(consultation_id, seq, kind, second, created_at)
+
+def migrate_consultation(consultation: dict):
+    consultation_id = consultation["consultation_id"]
+    resources = consultation["resources"]
+
+    # The legacy resources take seq 1..n; anything added since the deploy
+    # was already numbered after them
+    operations = []
+    for seq, resource in enumerate(resources, start=1):
+        if not isinstance(resource, (tuple, list)) or len(resource) != 3:
+            print(f"Skipping malformed resource {seq} of {consultation_id}: {resource!r}")
+            continue
+        operations.append(UpdateOne(
+            {"consultation_id": consultation_id, "seq": seq},
+            {"$setOnInsert": legacy_to_resource(consultation_id, seq, resource)},
+            upsert=True
+        ))
+    if operations:
+        db.consultation_resources.bulk_write(operations, ordered=False)
+
+    db.consultations.update_one(
+        {"_id": consultation["_id"]},
+        [
+            {"$set": {"resource_count": {"$max": [{"$ifNull": ["$resource_count", 0]}, len(resources)]}}},
+            {"$unset": "resources"}
+        ]
+    )
+    return len(operations)
+
+def main():
+    migrated = 0
+    moved = 0
+    for consultation in db.consultations.find({"resources": {"$exists": True}}, {"consultation_id": 1, "resources": 1}):
+        moved += migrate_consultation(consultation)
+        migrated += 1
+
+    # Consultations without resources still need a counter
+    db.consultations.update_many({"resource_count": {"$exists": False}}, {"$set": {"resource_count": 0}})
+    print(f"Moved {moved} resources of {migrated} consultations to consultation_resources")
+
+if __name__ == "__main__":
+    main()
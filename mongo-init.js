@@ -20,9 +20,11 @@ db.createUser({
 db.createCollection('patients');
 db.createCollection('consultations');
 db.createCollection('temp_files');
+db.createCollection('transcription_cache');
+db.createCollection('upload_sessions');
+db.createCollection('upload_parts');
+db.createCollection('tasks');
 
-// Create indexes for better performance
-db.consultations.createIndex({ "consultation_id": 1 }, { unique: true });
-db.temp_files.createIndex({ "file_id": 1 }, { unique: true });
+// Indexes are declared in elise/indexes.py and created by the API at startup
 
 print('MongoDB initialization completed successfully!'); 
\ No newline at end of file
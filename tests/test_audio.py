@@ -0,0 +1,119 @@
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import numpy as np
+import pytest
+from elise.audio import (
+    SAMPLE_RATE,
+    FRAME_SECONDS,
+    merge_transcripts,
+    find_split_points,
+    plan_segments,
+    detect_speech,
+    compact_speech,
+    to_original_time
+)
+
+
+def test_merge_keeps_the_overlap_once():
+    pieces = [
+        "el paciente refiere dolor de cabeza desde hace tres días",
+        "desde hace tres días y fiebre por la noche",
+    ]
+    assert merge_transcripts(pieces) == "el paciente refiere dolor de cabeza desde hace tres días y fiebre por la noche"
+
+
+def test_merge_drops_garbled_words_at_the_edges():
+    pieces = [
+        "toma metformina dos veces al día con las comi",
+        "ces al día con las comidas principales",
+    ]
+    assert merge_transcripts(pieces) == "toma metformina dos veces al día con las comidas principales"
+
+
+def test_merge_ignores_common_pairs_away_from_the_boundary():
+    first = "tiene antecedentes de la diabetes tipo dos controlada con metformina y presión arterial alta"
+    second = "arterial elevada. Revisamos también la función de la tiroides con resultados normales"
+    merged = merge_transcripts([first, second])
+    assert "diabetes tipo dos controlada con metformina" in merged
+    assert "función de la tiroides con resultados normales" in merged
+
+
+def test_merge_appends_pieces_without_overlap():
+    assert merge_transcripts(["buenos días", "¿cómo se encuentra?"]) == "buenos días ¿cómo se encuentra?"
+
+
+def test_merge_matches_words_regardless_of_case_and_punctuation():
+    pieces = ["le receto ibuprofeno cada ocho horas.", "Cada ocho horas, durante cinco días"]
+    # The words of the earlier piece are kept
+    assert merge_transcripts(pieces) == "le receto ibuprofeno cada ocho horas. durante cinco días"
+
+
+def test_merge_skips_empty_pieces():
+    assert merge_transcripts(["", "hola", ""]) == "hola"
+
+
+def _energies(seconds: float, quiet_at=()):
+    energies = np.full(int(seconds / FRAME_SECONDS), 1000.0, dtype=np.float32)
+    for second in quiet_at:
+        energies[int(second / FRAME_SECONDS)] = 1.0
+    return energies
+
+
+def test_split_points_move_to_the_quietest_frame():
+    cuts = find_split_points(_energies(100, quiet_at=[28, 57]), segment_seconds=30, search_seconds=5)
+    assert cuts[:2] == pytest.approx([28, 57], abs=FRAME_SECONDS)
+
+
+def test_split_points_are_deterministic():
+    energies = np.random.default_rng(1).random(4000).astype(np.float32)
+    assert find_split_points(energies, 20, 3) == find_split_points(energies.copy(), 20, 3)
+
+
+def test_short_recording_is_one_segment():
+    samples = np.zeros(SAMPLE_RATE * 10, dtype=np.int16)
+    assert plan_segments(samples, 30, 2, 5, 10) == [(0.0, 10.0)]
+
+
+def test_segments_overlap_and_cover_the_recording():
+    samples = (np.random.default_rng(2).standard_normal(SAMPLE_RATE * 100) * 1000).astype(np.int16)
+    segments = plan_segments(samples, 30, 2, 5, 10)
+    assert segments[0][0] == 0.0
+    assert segments[-1][1] == pytest.approx(100.0)
+    for previous, current in zip(segments, segments[1:]):
+        assert current[0] == pytest.approx(previous[1] - 2)
+
+
+def test_segments_grow_beyond_max_segments():
+    samples = (np.random.default_rng(3).standard_normal(SAMPLE_RATE * 100) * 1000).astype(np.int16)
+    assert len(plan_segments(samples, 10, 1, 2, 4)) <= 5
+
+
+def test_detect_speech_merges_short_silences_and_pads():
+    energies = np.zeros(int(10 / FRAME_SECONDS), dtype=np.float32)
+    frame = lambda seconds: int(round(seconds / FRAME_SECONDS))
+    energies[frame(1):frame(2)] = 500
+    energies[frame(2.2):frame(3)] = 500  # 0.2 s pause, kept inside the region
+    energies[frame(7):frame(8)] = 500
+    regions = detect_speech(energies, threshold=100, min_silence_seconds=0.5, padding_seconds=0.3)
+    assert regions == [
+        pytest.approx((0.7, 3.3), abs=FRAME_SECONDS),
+        pytest.approx((6.7, 8.3), abs=FRAME_SECONDS),
+    ]
+
+
+def test_detect_speech_without_speech():
+    assert detect_speech(np.zeros(100, dtype=np.float32), 100, 0.5, 0.3) == []
+
+
+def test_compact_speech_maps_back_to_the_original_time():
+    samples = np.arange(SAMPLE_RATE * 10, dtype=np.int64).astype(np.int16)
+    compacted, offset_map = compact_speech(samples, [(1.0, 2.0), (5.0, 7.0)])
+    assert len(compacted) == SAMPLE_RATE * 3
+    assert np.array_equal(compacted[:SAMPLE_RATE], samples[SAMPLE_RATE:2 * SAMPLE_RATE])
+    assert offset_map == [[0.0, 1.0, 1.0], [1.0, 5.0, 2.0]]
+    assert to_original_time(offset_map, 0.5) == pytest.approx(1.5)
+    assert to_original_time(offset_map, 1.5) == pytest.approx(5.5)
+    # Past the end stays at the end of the last region
+    assert to_original_time(offset_map, 4.0) == pytest.approx(7.0)
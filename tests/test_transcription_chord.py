@@ -0,0 +1,52 @@
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import pytest
+from celery.exceptions import ChordError
+from elise import task
+
+
+@pytest.fixture
+def failures(monkeypatch):
+    """Record what the failure helpers are called with instead of touching Redis and Mongo"""
+    calls = []
+    monkeypatch.setattr(task, "set_task_state", lambda task_id, state, **fields: calls.append(("state", task_id, state)))
+    monkeypatch.setattr(task, "publish_task_event", lambda task_id, state, **data: calls.append(("event", task_id, state)))
+    monkeypatch.setattr(task, "release_flight", lambda task_id: calls.append(("flight", task_id)))
+    monkeypatch.setattr(task, "release_user_task", lambda task_id: calls.append(("admission", task_id)))
+    monkeypatch.setattr(task, "refund_quota", lambda task_id: calls.append(("quota", task_id)))
+    return calls
+
+
+def _frozen_merge(task_id):
+    # What Task.replace does with the chord body: it takes over the id of
+    # the replaced transcription task
+    merge = task._merge_signature("file", "consultation", None, [])
+    merge.freeze(task_id)
+    return merge
+
+
+def test_failed_segment_fails_the_transcription_task(failures):
+    merge = _frozen_merge("transcription-task")
+
+    # The result backend calls this while handling the failure of a part
+    try:
+        raise ChordError("segment 2 failed")
+    except ChordError as exc:
+        task.celery_app.backend.chord_error_from_stack(merge, exc)
+
+    assert ("state", "transcription-task", "failed") in failures
+    assert ("event", "transcription-task", "failed") in failures
+    assert ("flight", "transcription-task") in failures
+    assert ("admission", "transcription-task") in failures
+    assert ("quota", "transcription-task") in failures
+
+
+def test_failed_merge_is_left_to_task_failure(failures):
+    merge = _frozen_merge("transcription-task")
+    request = type("Request", (), {"id": merge.id})()
+
+    task.transcription_failed_task(request, ValueError("merge failed"), None)
+
+    assert failures == []
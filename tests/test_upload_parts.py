@@ -0,0 +1,47 @@
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import pytest
+from elise import storage
+from elise.storage import UploadGap, UploadPartsReader
+
+
+class _Parts:
+    def __init__(self, parts):
+        self.parts = parts
+
+    def find(self, query):
+        return self
+
+    def sort(self, field, direction):
+        return iter(sorted(self.parts, key=lambda part: part["offset"]))
+
+
+def _reader(monkeypatch, parts, length):
+    monkeypatch.setattr(storage.db, "upload_parts", _Parts([
+        {"offset": offset, "data": data} for offset, data in parts
+    ]))
+    return UploadPartsReader("upload", length)
+
+
+def test_contiguous_parts_are_joined(monkeypatch):
+    reader = _reader(monkeypatch, [(0, b"abc"), (3, b"def"), (6, b"gh")], 8)
+    assert reader.read(5) == b"abcde"
+    assert reader.read() == b"fgh"
+    assert reader.read() == b""
+
+
+def test_overlapping_part_is_refused(monkeypatch):
+    # A retried request replaced the first part with a shorter range
+    reader = _reader(monkeypatch, [(0, b"ab"), (3, b"def")], 6)
+    with pytest.raises(UploadGap) as error:
+        reader.read()
+    assert error.value.offset == 2
+
+
+def test_missing_part_is_refused(monkeypatch):
+    reader = _reader(monkeypatch, [(0, b"abc")], 6)
+    with pytest.raises(UploadGap) as error:
+        reader.read()
+    assert error.value.offset == 3